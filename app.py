@@ -1,50 +1,151 @@
+import html
+import logging
 import os
+import uuid
 import gradio as gr
 from datetime import datetime
-from typing import Dict, List, Any
-from main import Agent, Prompt, BreakPrompt, AGENT_PROMPT_TEMPLATE
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from main import Agent, Prompt, AGENT_PROMPT_TEMPLATE
+from checkpoint import make_task_id
+from http_client import http_client
+from log_config import setup_logging
+from metrics import start_metrics_server
+from scheduler import SchedulerFull, scheduler
 
-def format_memory_blocks(blocks: Dict[str, str]) -> str:
-    """格式化记忆块为HTML展示"""
-    if not blocks:
-        return "<p>暂无记忆块</p>"
-    
-    html = ""
-    for block_id, content in blocks.items():
-        html += f'''
+logger = logging.getLogger(__name__)
+
+def render_memory_block(block_id: str, content: str) -> str:
+    """渲染单个记忆块（内容转义）"""
+    return f'''
         <div class="memory-block">
             <div class="block-id">{block_id}</div>
-            <div class="block-content">{content}</div>
+            <div class="block-content">{html.escape(str(content))}</div>
         </div>
         '''
-    return html
 
-def format_links(links: List[Dict[str, str]]) -> str:
-    """格式化重要链接为HTML展示，包含超链接"""
-    if not links:
-        return "<p>暂无重要链接</p>"
-    
-    html = "<ul>"
-    for link in links:
-        html += f'<li><a href="{link["url"]}" target="_blank">{link["title"]}</a></li>'
-    html += "</ul>"
-    return html
+def render_link(link: Dict[str, str]) -> str:
+    """渲染单个重要链接"""
+    url = html.escape(str(link.get("url", "")), quote=True)
+    title = html.escape(str(link.get("title", "")) or url)
+    return f'<li><a href="{url}" target="_blank">{title}</a></li>'
 
-def format_tool_records(tool_records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """格式化工具调用记录，便于折叠显示"""
-    formatted_records = []
-    if not tool_records:
-        return formatted_records
-    
-    for i, record in enumerate(tool_records):
-        formatted_records.append({
-            "index": i + 1,
-            "tool": record["tool"],
-            "input": record["input"],
-            "output": record["output"]
-        })
-    
-    return formatted_records
+def render_tool_record(index: int, record: Dict[str, Any]) -> str:
+    """渲染单条工具调用记录，便于折叠显示"""
+    return f"""
+            <div class="tool-record">
+                <details>
+                    <summary><strong>[{index}] {html.escape(str(record['tool']))}: {html.escape(str(record['input']))}</strong></summary>
+                    <div class="tool-output">
+                        <pre>{html.escape(str(record['output']))}</pre>
+                    </div>
+                </details>
+            </div>
+            """
+
+def render_usage(timings: List[Dict[str, Any]], totals: Dict[str, float]) -> str:
+    """渲染每轮和整个任务的模型用量表格"""
+    def row(label: str, llm: float, tools: float, usage: Dict[str, float]) -> str:
+        return (
+            f"<tr><td>{html.escape(label)}</td><td>{llm:.1f}s</td><td>{tools:.1f}s</td>"
+            f"<td>{usage.get('prompt_tokens', 0)}</td><td>{usage.get('completion_tokens', 0)}</td>"
+            f"<td>{usage.get('reasoning_tokens', 0)}</td><td>{usage.get('ttft_max', 0.0):.2f}s</td>"
+            f"<td>${usage.get('cost', 0.0):.4f}</td></tr>"
+        )
+
+    rows = [
+        row(
+            "总结" if timing["round"] == "summary" else f"第 {timing['round']} 轮",
+            timing.get("llm", 0.0),
+            timing.get("tools", 0.0),
+            timing.get("usage") or {},
+        )
+        for timing in timings
+    ]
+    rows.append(
+        row(
+            f"合计（{totals['calls']} 次调用）",
+            sum(timing.get("llm", 0.0) for timing in timings),
+            sum(timing.get("tools", 0.0) for timing in timings),
+            totals,
+        )
+    )
+    return (
+        '<table class="usage-table"><thead><tr><th>轮次</th><th>模型</th><th>工具</th>'
+        "<th>提示 tokens</th><th>输出 tokens</th><th>推理 tokens</th><th>首 token</th><th>费用</th>"
+        f"</tr></thead><tbody>{''.join(rows)}</tbody></table>"
+    )
+
+class ResultView:
+    """
+    增量渲染的结果 HTML
+
+    工具记录和重要链接只会追加，每轮只渲染新增的部分并拼接到已有的 HTML 之后；
+    记忆块可能被删除，按块缓存渲染结果，只渲染新增的块。
+    每部分带一个版本号，没有变化的部分不必再次发送给浏览器。
+    """
+
+    def __init__(self) -> None:
+        self.tools_html = ""
+        self.tool_count = 0
+        self.link_items: List[str] = []
+        self.link_count = 0
+        self.memory_fragments: Dict[str, Tuple[str, str]] = {}
+        self.memory_key: Tuple = ()
+        self.usage_html = "<p>暂无模型调用</p>"
+        self.usage_key: Tuple = ()
+        self.versions = {"tools": 0, "links": 0, "memory": 0, "usage": 0}
+
+    def add_tool_records(self, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        self.tools_html += "".join(
+            render_tool_record(self.tool_count + i, record) for i, record in enumerate(records, 1)
+        )
+        self.tool_count += len(records)
+        self.versions["tools"] += 1
+
+    def update_usage(self, timings: List[Dict[str, Any]], totals: Dict[str, float]) -> None:
+        key = (len(timings), totals["calls"])
+        if key == self.usage_key:
+            return
+        self.usage_html = render_usage(timings, totals)
+        self.usage_key = key
+        self.versions["usage"] += 1
+
+    def update_links(self, links: List[Dict[str, str]]) -> None:
+        if len(links) <= self.link_count:
+            return
+        self.link_items.extend(render_link(link) for link in links[self.link_count:])
+        self.link_count = len(links)
+        self.versions["links"] += 1
+
+    def update_memory(self, blocks: Dict[str, str]) -> None:
+        key = tuple(blocks.items())
+        if key == self.memory_key:
+            return
+        fragments = {}
+        for block_id, content in blocks.items():
+            cached = self.memory_fragments.get(block_id)
+            if cached is None or cached[0] != content:
+                cached = (content, render_memory_block(block_id, content))
+            fragments[block_id] = cached
+        self.memory_fragments = fragments
+        self.memory_key = key
+        self.versions["memory"] += 1
+
+    @property
+    def links_html(self) -> str:
+        return f"<ul>{''.join(self.link_items)}</ul>" if self.link_items else "<p>暂无重要链接</p>"
+
+    @property
+    def memory_html(self) -> str:
+        if not self.memory_fragments:
+            return "<p>暂无记忆块</p>"
+        return "".join(fragment for _, fragment in self.memory_fragments.values())
+
+    @property
+    def tool_html(self) -> str:
+        return self.tools_html or "<p>暂无工具调用记录</p>"
 
 class GradioAgent:
     def __init__(self):
@@ -55,41 +156,74 @@ class GradioAgent:
         self.important_links = []
         self.status = "等待开始"
         self.task = ""
-        
-    async def process_task(self, task: str, max_rounds: int = 8, progress=gr.Progress()) -> Dict:
-        """处理任务并返回结果"""
+        self.view = ResultView()
+
+    def _snapshot(self) -> Dict:
+        """当前结果；HTML 部分已增量渲染好"""
+        if self.agent is not None:
+            self.view.update_memory(self.agent.workspace.state["blocks"])
+            self.view.update_links(self.agent.workspace.state["important_links"])
+            self.view.update_usage(self.agent.timings, self.agent.usage.totals())
+        return {
+            "status": self.status,
+            "answer": self.answer if self.answer else "尚未生成答案",
+            "links_html": self.view.links_html,
+            "memory_html": self.view.memory_html,
+            "tools_html": self.view.tool_html,
+            "usage_html": self.view.usage_html,
+            "versions": dict(self.view.versions),
+        }
+
+    async def process_task(self, task: str, max_rounds: int = 8, client_id: str = "") -> AsyncIterator[Dict]:
+        """逐轮处理任务，每轮结束后产出当前结果；client_id 区分不同浏览器提交的相同任务"""
         self.task = task
         self.tools_used = []
         self.status = "进行中"
         self.answer = None
         self.important_links = []
+        self.view = ResultView()
         
         prompt = Prompt(AGENT_PROMPT_TEMPLATE)
         
         current_date = datetime.now().strftime("%Y-%m-%d")
-        self.agent = Agent(task=task, prompt=prompt, current_date=current_date)
+        # 服务重启前同一浏览器未完成的相同任务从检查点继续
+        task_id = make_task_id(f"{client_id}\n{task}")
+        self.agent = Agent.resume(task_id, prompt)
+        if self.agent is None or self.agent.workspace.is_done():
+            self.agent = Agent(task=task, prompt=prompt, current_date=current_date, task_id=task_id)
+        elif self.agent.tool_records:
+            self.view.add_tool_records(self.agent.tool_records)
         
         # 使用传入的max_rounds作为最大轮数
         try:
             # 遍历执行每一轮
-            for round_num in range(max_rounds):
-                progress((round_num) / max_rounds, f"执行第 {round_num + 1} 轮搜索...")
+            for round_num in range(self.agent.round, max_rounds):
+                self.status = f"执行第 {round_num + 1}/{max_rounds} 轮搜索..."
+                yield self._snapshot()
                 
                 # 执行一轮处理
                 await self.agent.run(loop=False)
+                if self.agent.stop_reason:
+                    # 超出任务的 token 或时间预算，直接生成总结
+                    self.status = f"提前停止：{self.agent.stop_reason}"
+                    yield self._snapshot()
+                    break
                 
                 # 记录工具调用
                 if self.agent.tool_records:
                     # 重要：深拷贝tool_records，避免引用同一个对象
-                    for record in self.agent.tool_records:
-                        # 使用字典复制而不是直接引用
-                        self.tools_used.append({
+                    new_records = [
+                        {
                             "tool": record["tool"],
                             "input": record["input"],
                             "output": record["output"]
-                        })
+                        }
+                        for record in self.agent.tool_records
+                    ]
+                    self.tools_used.extend(new_records)
+                    self.view.add_tool_records(new_records)
                     
-                    print(f"第 {round_num + 1} 轮工具调用: {len(self.agent.tool_records)} 个")
+                    logger.info("第 %d 轮工具调用: %d 个", round_num + 1, len(self.agent.tool_records))
                 
                 # 如果任务完成，跳出循环
                 if self.agent.workspace.is_done():
@@ -100,33 +234,23 @@ class GradioAgent:
             
             # 如果未完成，使用BreakPrompt生成总结
             if self.status != "已完成":
-                progress(0.9, "生成总结...")
-                brokeprompt = BreakPrompt()
-                self.answer = await brokeprompt.run(self.agent.workspace.to_string())
+                self.status = "生成总结..."
+                yield self._snapshot()
+                self.answer = await self.agent.summarize()
                 self.important_links = self.agent.workspace.state['important_links']
                 self.status = "已总结"
+            await self.agent.finish()
             
             # 打印工具调用总数
-            print(f"工具调用总数: {len(self.tools_used)}")
+            logger.info("工具调用总数: %d", len(self.tools_used))
         
         except Exception as e:
             self.status = "出错"
             self.answer = f"发生错误: {str(e)}"
-            print(f"执行过程中发生错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("执行过程中发生错误: %s", e)
         
-        # 返回结果
-        return {
-            "status": self.status,
-            "answer": self.answer if self.answer else "尚未生成答案",
-            "important_links": self.important_links,
-            "memory_blocks": self.agent.workspace.state["blocks"],
-            "tool_records": format_tool_records(self.tools_used)
-        }
-
-# 初始化代理
-gradio_agent = GradioAgent()
+        # 返回最终结果
+        yield self._snapshot()
 
 # 创建Gradio接口
 with gr.Blocks(css="""
@@ -166,6 +290,21 @@ with gr.Blocks(css="""
         text-decoration: underline;
     }
     
+    /* 模型用量表格 */
+    .usage-table {
+        width: 100%;
+        border-collapse: collapse;
+        margin-bottom: 15px;
+    }
+    .usage-table th, .usage-table td {
+        padding: 4px 8px;
+        text-align: right;
+        border-bottom: 1px solid var(--border-color-primary);
+    }
+    .usage-table th:first-child, .usage-table td:first-child {
+        text-align: left;
+    }
+    
     /* 工具调用记录样式 */
     .tool-record {
         margin-bottom: 15px;
@@ -255,67 +394,73 @@ with gr.Blocks(css="""
         
         with gr.TabItem("工具调用"):
             tools_container = gr.Accordion(label="工具调用记录容器", open=True)
+            usage_output = gr.HTML("<p>暂无模型调用</p>", label="模型用量")
             with tools_container:
                 tools_output = gr.HTML("暂无工具调用记录")
-    
-    async def process_query(task, max_rounds):
-        results = await gradio_agent.process_task(task, int(max_rounds))
-        
-        # 格式化记忆块
-        memory_html = ""
-        if results["memory_blocks"]:
-            for block_id, content in results["memory_blocks"].items():
-                # 确保HTML标签被转义
-                safe_content = content.replace("<", "&lt;").replace(">", "&gt;")
-                memory_html += f'''
-                <div class="memory-block">
-                    <div class="block-id">{block_id}</div>
-                    <div class="block-content">{safe_content}</div>
-                </div>
-                '''
-        else:
-            memory_html = "<p>暂无记忆块</p>"
-        
-        # 格式化链接
-        links_html = format_links(results["important_links"])
-        
-        # 格式化工具调用记录为HTML
-        tools_html = ""
-        for record in results["tool_records"]:
-            tools_html += f"""
-            <div class="tool-record">
-                <details>
-                    <summary><strong>[{record['index']}] {record['tool']}: {record['input']}</strong></summary>
-                    <div class="tool-output">
-                        <pre>{record['output']}</pre>
-                    </div>
-                </details>
-            </div>
-            """
-        
-        if not tools_html:
-            tools_html = "<p>暂无工具调用记录</p>"
-        
-        return [
-            results["status"],
-            results["answer"],
-            links_html,
-            memory_html,
-            tools_html
-        ]
+
+    # 每个浏览器会话各自的代理状态，并发用户互不干扰
+    session_agent = gr.State(None)
+    # 保存在浏览器本地的客户端 ID：session_hash 每次打开页面都会变，
+    # 检查点按客户端 ID 区分，刷新页面或服务重启后仍能继续之前未完成的任务
+    client_id = gr.BrowserState(None, storage_key="deepsearch_client_id")
+
+    def ensure_client_id(saved_id):
+        return saved_id or uuid.uuid4().hex
+
+    Web_UI.load(ensure_client_id, inputs=client_id, outputs=client_id)
+
+    async def process_query(task, max_rounds, gradio_agent, saved_id, request: gr.Request):
+        if gradio_agent is None:
+            gradio_agent = GradioAgent()
+
+        user = request.session_hash or "anonymous"
+        if scheduler.running >= scheduler.max_concurrency or scheduler.waiting:
+            yield [f"排队中（当前运行 {scheduler.running} 个任务，{scheduler.waiting} 个排队）",
+                   gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gradio_agent]
+
+        # 所有会话共享调度器：限制同时运行的任务数，并在用户之间轮转排队
+        sent = {}
+        try:
+            async with scheduler.slot(user):
+                async for results in gradio_agent.process_task(task, int(max_rounds), saved_id or user):
+                    # 只发送有变化的 HTML，工具记录越来越长时避免每轮重复传输
+                    updates = []
+                    for part, key in (
+                        ("links", "links_html"),
+                        ("memory", "memory_html"),
+                        ("tools", "tools_html"),
+                        ("usage", "usage_html"),
+                    ):
+                        version = results["versions"][part]
+                        updates.append(results[key] if sent.get(part) != version else gr.update())
+                        sent[part] = version
+                    yield [results["status"], results["answer"], *updates, gradio_agent]
+        except SchedulerFull:
+            yield ["排队任务过多，请稍后再试", gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gradio_agent]
     
     submit_btn.click(
         fn=process_query,
-        inputs=[task_input, max_rounds_slider],
+        inputs=[task_input, max_rounds_slider, session_agent, client_id],
         outputs=[
             status_output,
             answer_output,
             links_output,
             memory_output,
-            tools_output
-        ]
+            tools_output,
+            usage_output,
+            session_agent
+        ],
+        # 并发由 scheduler 控制，不使用 Gradio 默认的单任务队列
+        concurrency_limit=None
     )
 
 # 启动入口
 if __name__ == "__main__":
-    Web_UI.launch(server_name="0.0.0.0", server_port=7860, favicon_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "favicon.ico")) 
\ No newline at end of file
+    setup_logging()
+    # 设置了 METRICS_PORT 时与 Gradio 一起提供 Prometheus 指标端点
+    start_metrics_server()
+    try:
+        Web_UI.launch(server_name="0.0.0.0", server_port=7860, favicon_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "favicon.ico"))
+    finally:
+        # 服务退出时关闭共享连接池
+        http_client.close_sync()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量运行任务
+
+从 JSONL 文件读取任务，并发运行多个 Agent（共享连接池、搜索缓存和抓取缓存），
+每完成一个任务就把结果追加写入输出 JSONL。再次运行时跳过输出文件中已完成的任务。
+
+输入每行一个任务：
+    {"id": "sg-trip", "task": "帮我制定一个新加坡旅游计划..."}
+id 可省略，默认使用任务文本的哈希。
+
+用法:
+    python batch.py tasks.jsonl results.jsonl --concurrency 4 --max-rounds 8
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Set
+
+from checkpoint import make_task_id
+from http_client import http_client
+from main import Agent, prompt
+from log_config import setup_logging
+from metrics import start_metrics_server, tool_metrics
+
+logger = logging.getLogger(__name__)
+
+# 输出中这些状态表示任务已经完成，续跑时跳过
+DONE_STATUSES = ("已完成", "已总结")
+
+
+def task_id(item: Dict[str, Any]) -> str:
+    if item.get("id") is not None:
+        return str(item["id"])
+    return make_task_id(item["task"])
+
+
+def load_tasks(path: str) -> List[Dict[str, Any]]:
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"task": item}
+            if not item.get("task"):
+                raise ValueError(f"{path}:{line_number} 缺少 task 字段")
+            item["id"] = task_id(item)
+            tasks.append(item)
+    return tasks
+
+
+def load_completed(path: str) -> Set[str]:
+    """输出文件中已完成的任务 id（出错的任务会重新运行）"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 上次运行中途退出时最后一行可能不完整
+                continue
+            if record.get("status") in DONE_STATUSES:
+                completed.add(record["id"])
+    return completed
+
+
+async def run_task(item: Dict[str, Any], max_rounds: int) -> Dict[str, Any]:
+    """运行单个任务，返回结果记录"""
+    start = time.perf_counter()
+    # 上次运行中途退出的任务从最新的检查点继续，已用完轮数的任务不再调用模型，直接总结
+    agent = Agent.resume(item["id"], prompt)
+    if agent is None or agent.task != item["task"]:
+        agent = Agent(task=item["task"], prompt=prompt, task_id=item["id"])
+    if not agent.workspace.is_done():
+        await agent.run(loop=True, max_rounds=max_rounds)
+
+    state = agent.workspace.state
+    if state["status"] == "已完成":
+        status, answer = "已完成", state["answer"]
+    else:
+        # 轮数用完或超出任务预算（TASK_MAX_TOKENS / TASK_MAX_SECONDS）
+        answer = await agent.summarize()
+        status = "已总结"
+    # 结果记录由调用方写入输出文件，之后靠输出文件跳过已完成的任务
+    await agent.finish()
+
+    return {
+        "id": item["id"],
+        "task": item["task"],
+        "status": status,
+        "answer": answer,
+        "important_links": state["important_links"],
+        "rounds": agent.round,
+        "tool_calls": len(agent.ledger),
+        "stop_reason": agent.stop_reason,
+        "timings": {"total": time.perf_counter() - start, "rounds": agent.timings},
+        "usage": agent.usage.totals(),
+    }
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int,
+    max_rounds: int,
+    task_timeout: float | None,
+) -> None:
+    tasks = load_tasks(input_path)
+    completed = load_completed(output_path)
+    pending = [item for item in tasks if item["id"] not in completed]
+    print(f"共 {len(tasks)} 个任务，已完成 {len(tasks) - len(pending)} 个，本次运行 {len(pending)} 个")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+
+    counts = {"done": 0, "failed": 0}
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(output_path, "a", encoding="utf-8") as output:
+
+        async def worker() -> None:
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                try:
+                    record = await asyncio.wait_for(run_task(item, max_rounds), task_timeout)
+                    counts["done"] += 1
+                except Exception as e:
+                    logger.exception("任务 %s 失败", item["id"])
+                    record = {
+                        "id": item["id"],
+                        "task": item["task"],
+                        "status": "出错",
+                        "error": repr(e),
+                        "timings": {"total": time.perf_counter() - start},
+                    }
+                    counts["failed"] += 1
+                # 逐条写入并立即落盘，中途退出时已完成的任务不会丢失
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                print(
+                    f"[{counts['done'] + counts['failed']}/{len(pending)}] {item['id']}: "
+                    f"{record['status']} ({record['timings']['total']:.1f}s)"
+                )
+
+        async with http_client.lifespan():
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    print(f"\n完成 {counts['done']} 个，出错 {counts['failed']} 个，结果写入 {output_path}")
+    print(f"\n工具延迟:\n{tool_metrics.summary()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从 JSONL 文件批量运行任务")
+    parser.add_argument("input", help="任务文件（JSONL，每行 {\"id\": ..., \"task\": ...}）")
+    parser.add_argument("output", help="结果文件（JSONL，追加写入）")
+    parser.add_argument(
+        "--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")), help="同时运行的任务数"
+    )
+    parser.add_argument("--max-rounds", type=int, default=8, help="每个任务的最大轮数")
+    parser.add_argument("--task-timeout", type=float, default=None, help="单个任务的超时（秒），默认不限制")
+    parser.add_argument(
+        "--metrics-port", type=int, default=None, help="Prometheus 指标端口（默认读取 METRICS_PORT，0 表示不启动）"
+    )
+    args = parser.parse_args()
+    setup_logging()
+    start_metrics_server(args.metrics_port)
+    try:
+        asyncio.run(
+            run_batch(args.input, args.output, args.concurrency, args.max_rounds, args.task_timeout)
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HTML 提取引擎吞吐量基准测试
+
+在夹具语料上依次运行每个已安装的提取器（selectolax / lxml / bs4），
+报告每秒处理的页面数、MB/s，以及输出正文和链接数量，便于核对各引擎结果是否一致。
+
+用法:
+    python benchmarks/bench_extract.py --repeat 3
+    python benchmarks/bench_extract.py --corpus ./saved_pages
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+from extractors import EXTRACTORS  # noqa: E402
+
+
+def main(repeat: int, corpus: str | None) -> None:
+    pages = fixtures.load(corpus) if corpus else fixtures.generate()
+    total_bytes = sum(len(html.encode("utf-8")) for _, html in pages)
+    print(f"语料: {len(pages)} 个页面, {total_bytes / 1024 / 1024:.2f} MB")
+
+    for name, (extractor_class, available) in EXTRACTORS.items():
+        if not available:
+            print(f"{name:>10}: 未安装")
+            continue
+        extractor = extractor_class()
+        best = float("inf")
+        text_chars = links = 0
+        for _ in range(repeat):
+            text_chars = links = 0
+            start = time.perf_counter()
+            for _, html in pages:
+                text, page_links = extractor.extract(html, "https://example.com/page")
+                text_chars += len(text)
+                links += len(page_links)
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"{name:>10}: {len(pages) / best:8.1f} 页/秒  {total_bytes / 1024 / 1024 / best:7.2f} MB/s  "
+            f"正文 {text_chars:>9} 字符  链接 {links:>6}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTML 提取引擎吞吐量基准测试")
+    parser.add_argument("--repeat", type=int, default=3, help="每个引擎的重复次数（取最快）")
+    parser.add_argument("--corpus", help="包含 *.html 文件的目录（默认使用生成的夹具）")
+    args = parser.parse_args()
+    main(args.repeat, args.corpus)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+extract_largest_json 微基准测试
+
+对比旧的嵌套正则实现与新的单遍扫描实现（以及分块输入的流式版本）
+在 100KB 以上的推理模型输出上的耗时和结果正确性。
+
+用法:
+    python benchmarks/bench_json.py --size 200000 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_stream import StreamingJsonExtractor  # noqa: E402
+from tools import extract_largest_json  # noqa: E402
+
+
+def legacy_extract_largest_json(text):
+    """改写前的实现，仅用于对比"""
+    json_pattern = r'\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}'
+    matches = re.findall(json_pattern, text)
+    if not matches:
+        return None
+    matches.sort(key=len, reverse=True)
+    for match in matches:
+        try:
+            return json.loads(match)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def make_response(size: int, seed: int = 0) -> tuple[str, dict]:
+    """生成一段类似推理模型输出的文本：大量带花括号的推理内容 + 最终的深层嵌套 JSON"""
+    rng = random.Random(seed)
+    answer = {
+        "status_update": "进行中",
+        "memory_updates": [
+            {"operation": "add", "content": f"发现 {i}: 价格 {{SGD {i}}} 来源 https://example.com/{i}"}
+            for i in range(20)
+        ],
+        "tool_calls": [
+            {"tool": "search", "input": "新加坡 书店 营业时间"},
+            {"tool": "scrape", "input": "https://example.com/books"},
+        ],
+        "answer": "",
+        "important_links": [{"url": "https://example.com", "title": "示例"}],
+        "meta": {"a": {"b": {"c": {"d": {"e": ["深层嵌套"]}}}}},
+    }
+    pieces = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.2:
+            piece = '草稿 {"tool": "search", "input": "q%d"} ' % rng.randint(0, 999)
+        elif kind < 0.3:
+            piece = "集合 {a, {b, c}} 和 {未闭合 "
+        else:
+            piece = "让我想想下一步需要调用哪些工具，以及哪些记忆块需要删除。"
+        pieces.append(piece)
+        length += len(piece)
+    text = "".join(pieces) + "\n```json\n" + json.dumps(answer, ensure_ascii=False) + "\n```"
+    return text, answer
+
+
+def bench(fn, text: str, repeat: int) -> tuple[float, object]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def streaming(text: str, chunk_size: int = 64) -> dict | None:
+    extractor = StreamingJsonExtractor()
+    for i in range(0, len(text), chunk_size):
+        extractor.feed(text[i:i + chunk_size])
+    return extractor.close()
+
+
+def main(size: int, repeat: int) -> None:
+    text, answer = make_response(size)
+    print(f"输入大小: {len(text) / 1024:.1f} KB")
+    for name, fn in (
+        ("legacy regex", legacy_extract_largest_json),
+        ("scanner", extract_largest_json),
+        ("streaming", streaming),
+    ):
+        elapsed, result = bench(fn, text, repeat)
+        print(f"{name:>13}: {elapsed * 1000:8.2f} ms  正确: {result == answer}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="extract_largest_json 微基准测试")
+    parser.add_argument("--size", type=int, default=200_000, help="推理文本的字符数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个实现的重复次数（取最快）")
+    args = parser.parse_args()
+    main(args.size, args.repeat)
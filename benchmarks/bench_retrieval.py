@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ScrapTool 段落检索基准测试
+
+生成一个大型中文网页（大量无关段落 + 少量包含答案的段落 + 长链接列表），
+对比旧的关键词过滤与 BM25 段落检索的耗时、输出大小以及是否保留了答案段落。
+
+用法:
+    python benchmarks/bench_retrieval.py --paragraphs 5000 --repeat 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors import get_extractor  # noqa: E402
+from llm import estimate_tokens  # noqa: E402
+from retrieval import PassageIndex, format_passages  # noqa: E402
+
+TASK = "新加坡有哪些独立书店，它们的营业时间是什么？"
+NEEDLES = [
+    "城中书店（BooksActually）位于中峇鲁，营业时间为每天上午十点至晚上八点。",
+    "草根书室的营业时间是周二至周日中午十二点到晚上九点，周一休息。",
+]
+FILLER = [
+    "本站提供最新的旅游资讯、美食推荐和购物指南，欢迎订阅我们的电子报。",
+    "天气预报显示本周多云，局部地区有雷阵雨，请市民出门携带雨具。",
+    "The museum reopens next month with a new exhibition on maritime history.",
+    "会员积分可以在结账时抵扣现金，详情请咨询客服热线。",
+    "交通部宣布地铁新线将于明年通车，沿线将新增八个车站。",
+]
+
+
+def make_page(paragraphs: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    body = [f"<p>{rng.choice(FILLER)} {rng.choice(FILLER)}</p>" for _ in range(paragraphs)]
+    for needle in NEEDLES:
+        body.insert(rng.randrange(len(body)), f"<p>{needle}</p>")
+    links = [f'<a href="/article/{i}">相关文章 {i}</a>' for i in range(paragraphs // 5)]
+    return (
+        "<html><head><title>新加坡生活指南</title><script>var x = 1;</script></head><body>"
+        + "".join(body)
+        + "<nav>" + "".join(links) + "</nav></body></html>"
+    )
+
+
+def legacy_filter(text: str, context: str) -> str:
+    """改写前的实现：按空白切分上下文得到关键词，保留包含任一关键词的段落"""
+    context_keywords = context.lower().split()
+    paragraphs = text.split("\n\n")
+    relevant = [p for p in paragraphs if any(k in p.lower() for k in context_keywords)]
+    return "\n\n".join(relevant) if relevant else text
+
+
+def bm25_filter(text: str, context: str, top_n: int = 8) -> str:
+    return format_passages(PassageIndex(text).search(context, top_n))
+
+
+def bench(fn, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(paragraphs: int, repeat: int) -> None:
+    html = make_page(paragraphs)
+    url = "https://example.com/guide"
+    elapsed, (text, links) = bench(lambda: get_extractor().extract(html, url), repeat)
+    print(f"页面大小: {len(html) / 1024:.1f} KB  正文: {len(text) / 1024:.1f} KB  链接: {len(links)}")
+    print(f"{'extract':>8}: {elapsed * 1000:8.2f} ms")
+
+    # 旧实现在过滤前已把链接摘要拼到正文后面
+    with_links = text + "\n\n链接摘要:\n" + "\n".join(f"{t}: {h}" for t, h in links)
+    for name, fn in (
+        ("legacy", lambda: legacy_filter(with_links, TASK)),
+        ("bm25", lambda: bm25_filter(text, TASK)),
+    ):
+        elapsed, output = bench(fn, repeat)
+        found = sum(needle in output for needle in NEEDLES)
+        print(
+            f"{name:>8}: {elapsed * 1000:8.2f} ms  输出 {len(output):>8} 字符 / "
+            f"{estimate_tokens(output):>7} tokens  命中答案 {found}/{len(NEEDLES)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ScrapTool 段落检索基准测试")
+    parser.add_argument("--paragraphs", type=int, default=5000, help="页面段落数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个实现的重复次数（取最快）")
+    args = parser.parse_args()
+    main(args.paragraphs, args.repeat)
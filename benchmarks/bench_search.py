@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+SearchTool 并发基准测试
+
+启动一个本地的模拟 Tavily 服务（每次搜索固定延迟），
+像 Agent.run 一样用 asyncio.gather 并发发起一轮搜索，
+对比整轮耗时与单次调用耗时之和 / 最大值。
+
+用法:
+    python benchmarks/bench_search.py --delay 0.5 --calls 3
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import http_client  # noqa: E402
+from tools import SearchTool  # noqa: E402
+
+
+def make_app(delay: float) -> web.Application:
+    async def search(request: web.Request) -> web.Response:
+        data = await request.json()
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {
+                "query": data["query"],
+                "results": [
+                    {
+                        "url": f"https://example.com/{i}",
+                        "title": f"{data['query']} #{i}",
+                        "content": "模拟搜索结果",
+                    }
+                    for i in range(5)
+                ],
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/search", search)
+    return app
+
+
+async def timed_call(tool: SearchTool, query: str) -> float:
+    start = time.perf_counter()
+    await tool(query)
+    return time.perf_counter() - start
+
+
+async def bench_backend(backend: str, calls: int) -> dict:
+    tool = SearchTool(backend=backend)
+    # 预热（建立客户端、线程池等）
+    await tool("warmup")
+
+    start = time.perf_counter()
+    durations = await asyncio.gather(
+        *[timed_call(tool, f"query {i}") for i in range(calls)]
+    )
+    round_time = time.perf_counter() - start
+    return {
+        "backend": backend,
+        "round": round_time,
+        "sum": sum(durations),
+        "max": max(durations),
+    }
+
+
+async def main(delay: float, calls: int, port: int) -> None:
+    runner = web.AppRunner(make_app(delay))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+
+    os.environ["TAVILY_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+    try:
+        for backend in ("aiohttp", "executor"):
+            r = await bench_backend(backend, calls)
+            print(
+                f"{r['backend']:>9}: round={r['round']:.3f}s "
+                f"sum={r['sum']:.3f}s max={r['max']:.3f}s "
+                f"overlap={r['sum'] / r['round']:.2f}x"
+            )
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SearchTool 并发基准测试")
+    parser.add_argument("--delay", type=float, default=0.5, help="模拟搜索延迟（秒）")
+    parser.add_argument("--calls", type=int, default=3, help="每轮并发搜索次数")
+    parser.add_argument("--port", type=int, default=8765, help="模拟服务端口")
+    args = parser.parse_args()
+    asyncio.run(main(args.delay, args.calls, args.port))
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+离线端到端基准测试
+
+在本机启动模拟的 OpenRouter、Tavily 和静态网站（见 stubs.py），不访问任何外部服务，测量：
+
+- agent:  Agent.run 的端到端任务延迟、每秒轮数，以及各阶段耗时
+          （render 渲染提示词、budget 裁剪提示词、llm、parse 提取 JSON、search、scrape、
+          extraction HTML/PDF 提取、retrieval 段落检索）
+- scrape: ScrapTool 抓取每类页面（含超大页面和慢速主机）的延迟和输出大小
+- json:   extract_largest_json 在不同大小的推理输出上的耗时
+
+每项另外单独运行一次 tracemalloc 记录峰值内存（不影响计时）。
+结果以 JSON 输出，便于保存下来对比不同提交之间的性能回归。
+
+各阶段是嵌套和并发的：scrape 包含 extraction 和 retrieval，budget 包含一次 render，
+同一轮的工具调用并发执行，所以各阶段耗时之和会大于任务的墙钟时间。
+
+用法:
+    python benchmarks/bench_suite.py --tasks 4 --rounds 3 --output bench.json
+    python benchmarks/bench_suite.py --only json scrape --stream --llm-latency 1.0
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import StubServers  # noqa: E402
+
+SCENARIOS = ("agent", "scrape", "json")
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": pick(0.5),
+        "p95": pick(0.95),
+        "max": ordered[-1],
+    }
+
+
+class StageTimer:
+    """临时替换被测函数，记录每次调用的耗时，退出时恢复原函数"""
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self._patched: List[tuple] = []
+
+    def wrap(self, owner: Any, name: str, stage: str) -> None:
+        original = getattr(owner, name)
+        durations = self.durations[stage]
+
+        if inspect.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - start)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - start)
+
+        self._patched.append((owner, name, original))
+        setattr(owner, name, timed)
+
+    def reset(self) -> None:
+        for values in self.durations.values():
+            values.clear()
+
+    def restore(self) -> None:
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched.clear()
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {stage: summarize(values) for stage, values in sorted(self.durations.items())}
+
+
+def stage_timer() -> StageTimer:
+    import main
+    from llm import OpenRouterModel
+    from prompt import Prompt
+    from token_budget import PromptBudget
+    from tools import ScrapTool, SearchTool
+
+    timer = StageTimer()
+    timer.wrap(Prompt, "__call__", "render")
+    timer.wrap(PromptBudget, "apply", "budget")
+    timer.wrap(OpenRouterModel, "_request", "llm")
+    # main 模块中引用的是导入时的函数对象，要替换 main 中的名字
+    timer.wrap(main, "extract_largest_json", "parse")
+    timer.wrap(SearchTool, "search", "search")
+    timer.wrap(ScrapTool, "get_page", "scrape")
+    timer.wrap(ScrapTool, "extract_body", "extraction")
+    timer.wrap(ScrapTool, "filter_relevant", "retrieval")
+    return timer
+
+
+async def peak_memory(fn: Callable[[], Awaitable[Any]]) -> int:
+    """单独运行一次并返回 Python 分配的峰值内存（字节）"""
+    tracemalloc.start()
+    try:
+        await fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    """计时期间丢弃标准输出，避免被测代码中的输出混入 JSON 结果（日志写到标准错误，由 --verbose 控制）"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def log(message: str) -> None:
+    print(message, file=sys.stderr)
+
+
+async def bench_agent(args: argparse.Namespace) -> Dict[str, Any]:
+    from main import Agent, prompt
+
+    timer = stage_timer()
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    latencies: List[float] = []
+    rounds: List[int] = []
+
+    async def run_one(index: int, tag: str) -> None:
+        async with semaphore:
+            agent = Agent(task=f"基准测试任务 {tag}-{index}：新加坡书店营业时间", prompt=prompt)
+            start = time.perf_counter()
+            await agent.run(loop=True, max_rounds=args.rounds + 1)
+            latencies.append(time.perf_counter() - start)
+            rounds.append(agent.round)
+
+    try:
+        with quiet(not args.verbose):
+            # 预热：建立连接、加载提取器
+            await run_one(0, "warmup")
+            latencies.clear()
+            rounds.clear()
+            timer.reset()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(run_one(i, "timed") for i in range(args.tasks)))
+            wall = time.perf_counter() - start
+            stages = timer.report()
+
+            memory = await peak_memory(lambda: run_one(0, "memory"))
+    finally:
+        timer.restore()
+
+    result = {
+        "tasks": args.tasks,
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "task_latency": summarize(latencies),
+        "rounds": sum(rounds),
+        "rounds_per_second": sum(rounds) / wall if wall else 0.0,
+        "stages": stages,
+        "peak_memory_bytes": memory,
+    }
+    log(
+        f"agent: {args.tasks} 个任务 {wall:.2f}s，{result['rounds_per_second']:.2f} 轮/秒，"
+        f"任务 p50={result['task_latency']['p50']:.2f}s，峰值内存 {memory / 1024 / 1024:.1f} MB"
+    )
+    for stage, stats in stages.items():
+        if stats["count"]:
+            log(f"  {stage:>10}: {stats['count']:4d} 次  合计 {stats['total']:7.3f}s  p95 {stats['p95'] * 1000:8.1f} ms")
+    return result
+
+
+async def bench_scrape(args: argparse.Namespace, stubs: StubServers) -> Dict[str, Any]:
+    from tools import ScrapTool
+
+    timer = stage_timer()
+    context = "新加坡 书店 营业时间"
+    pages = {}
+    try:
+        with quiet(not args.verbose):
+            tool = ScrapTool(cache=None)
+            for path in stubs.site.paths():
+                url = stubs.site_url + path
+                latencies = []
+                output = ""
+                timer.reset()
+                for _ in range(args.repeat):
+                    # 清掉段落索引缓存，每次都完整地走一遍抓取、提取和检索
+                    tool._indexes.clear()
+                    start = time.perf_counter()
+                    output = await tool(url, context)
+                    latencies.append(time.perf_counter() - start)
+                stages = timer.report()
+                tool._indexes.clear()
+                memory = await peak_memory(lambda: tool(url, context))
+                pages[path] = {
+                    "latency": summarize(latencies),
+                    "extraction": stages.get("extraction", {}),
+                    "retrieval": stages.get("retrieval", {}),
+                    "output_chars": len(output),
+                    "peak_memory_bytes": memory,
+                }
+                log(
+                    f"scrape {path:>24}: p50 {pages[path]['latency']['p50'] * 1000:8.1f} ms  "
+                    f"输出 {len(output):>6} 字符  峰值内存 {memory / 1024 / 1024:6.1f} MB"
+                )
+    finally:
+        timer.restore()
+    return {"extractor": type(tool.extractor).__name__, "pages": pages}
+
+
+async def bench_json(args: argparse.Namespace) -> Dict[str, Any]:
+    from bench_json import make_response
+    from tools import extract_largest_json
+
+    results = {}
+    for size in args.json_sizes:
+        text, answer = make_response(size)
+        timings = []
+        parsed = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parsed = extract_largest_json(text)
+            timings.append(time.perf_counter() - start)
+
+        async def once() -> None:
+            extract_largest_json(text)
+
+        memory = await peak_memory(once)
+        results[str(size)] = {
+            "input_chars": len(text),
+            "latency": summarize(timings),
+            "correct": parsed == answer,
+            "peak_memory_bytes": memory,
+        }
+        log(
+            f"json {size:>8}: p50 {results[str(size)]['latency']['p50'] * 1000:8.2f} ms  "
+            f"正确: {parsed == answer}  峰值内存 {memory / 1024:.0f} KB"
+        )
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(args: argparse.Namespace, stubs: StubServers) -> None:
+    """在导入 main / tools 之前把所有外部服务指向替身，并关闭缓存、限速和录制"""
+    os.environ.update(
+        {
+            "API_BASE_URL": stubs.llm_url,
+            "LLM_API_KEY": "bench",
+            "MODEL_NAME": "bench/fake-model",
+            "TAVILY_BASE_URL": stubs.tavily_url,
+            "TAVILY_API_KEY": "bench",
+            "SEARCH_BACKEND": "aiohttp",
+            "SEARCH_CACHE": "off",
+            "SCRAPE_CACHE": "off",
+            "CASSETTE_MODE": "off",
+            "CHECKPOINT": "off",
+            "LLM_RPM": "0",
+            "LLM_TPM": "0",
+            "LLM_STREAM": "1" if args.stream else "0",
+        }
+    )
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    async with StubServers(
+        llm_latency=args.llm_latency,
+        reasoning_chars=args.reasoning_chars,
+        chars_per_second=args.llm_cps,
+        rounds=args.rounds,
+        script=args.script,
+        search_latency=args.search_latency,
+        huge_mb=args.huge_mb,
+        slow_seconds=args.slow_seconds,
+    ) as stubs:
+        configure_environment(args, stubs)
+        from http_client import http_client
+
+        report: Dict[str, Any] = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {
+                    key: value for key, value in vars(args).items() if key not in ("output", "script")
+                },
+            }
+        }
+        async with http_client.lifespan():
+            if "json" in args.only:
+                report["json"] = await bench_json(args)
+            if "scrape" in args.only:
+                report["scrape"] = await bench_scrape(args, stubs)
+            if "agent" in args.only:
+                report["agent"] = await bench_agent(args)
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线端到端基准测试（本地模拟 OpenRouter、Tavily 和网站）")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="只运行指定的项目")
+    parser.add_argument("--tasks", type=int, default=4, help="agent: 计时的任务数")
+    parser.add_argument("--concurrency", type=int, default=4, help="agent: 同时运行的任务数")
+    parser.add_argument("--rounds", type=int, default=3, help="agent: 默认脚本中每个任务的轮数")
+    parser.add_argument("--script", help="agent: 脚本化响应的 JSON 文件（响应对象的列表，按轮次依次返回）")
+    parser.add_argument("--stream", action="store_true", help="agent: 使用 SSE 流式输出")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="模拟 LLM 首字节延迟（秒）")
+    parser.add_argument("--llm-cps", type=float, default=0, help="模拟 LLM 每秒输出的字符数（0 表示不限速）")
+    parser.add_argument("--reasoning-chars", type=int, default=2000, help="模拟推理内容的字符数")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="模拟搜索延迟（秒）")
+    parser.add_argument("--huge-mb", type=float, default=8.0, help="超大页面的大小（MB）")
+    parser.add_argument("--slow-seconds", type=float, default=2.0, help="慢速主机返回整个页面所用的时间（秒）")
+    parser.add_argument(
+        "--json-sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000], help="json: 推理文本的字符数"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="scrape/json: 每项的重复次数")
+    parser.add_argument("--output", help="结果写入的 JSON 文件（默认输出到标准输出）")
+    parser.add_argument("--verbose", action="store_true", help="输出 Agent 和工具的 INFO 级别日志，并保留标准输出")
+    args = parser.parse_args()
+    if args.verbose:
+        from log_config import setup_logging
+
+        setup_logging("INFO")
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            args.script = json.load(f)
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"结果写入 {args.output}")
+    else:
+        print(text)
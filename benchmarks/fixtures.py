@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+基准测试用的 HTML 夹具语料
+
+按固定随机种子生成几类常见网页（新闻文章、商品列表、文档页、导航很重的门户页），
+大小从几 KB 到几百 KB 不等；也可以用 --corpus 指定一个目录，读取其中真实保存的 *.html。
+"""
+
+import glob
+import os
+import random
+from typing import List, Tuple
+
+SENTENCES = [
+    "新加坡国家图书馆管理局宣布延长周末开放时间。",
+    "这家独立书店专注于东南亚文学和本地作家的作品。",
+    "The store hosts weekly readings and a small café on the second floor.",
+    "营业时间为周一至周六上午十点至晚上九点，周日休息。",
+    "Prices include GST and free delivery for orders above $50.",
+    "读者可以通过官方网站预约参观并查询最新活动。",
+]
+
+NAV = "".join(f'<li><a href="/section/{i}">栏目 {i}</a></li>' for i in range(40))
+HEAD = (
+    "<head><meta charset='utf-8'><title>{title}</title>"
+    "<style>body {{ font-family: sans-serif; }} .ad {{ display: none; }}</style>"
+    "<script>window.dataLayer = window.dataLayer || []; function gtag() {{ dataLayer.push(arguments); }}</script>"
+    "</head>"
+)
+FOOTER = (
+    "<footer><p>© 2025 示例网站</p>"
+    + "".join(f'<a href="/legal/{i}">条款 {i}</a>' for i in range(15))
+    + "</footer>"
+)
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 6)))
+
+
+def article(rng: random.Random, paragraphs: int) -> str:
+    body = "".join(
+        f"<p>{_paragraph(rng)} <a href='/related/{rng.randint(0, 999)}'>相关阅读</a></p>"
+        if rng.random() < 0.2
+        else f"<p>{_paragraph(rng)}</p>"
+        for _ in range(paragraphs)
+    )
+    aside = "<aside>" + "".join(f"<div class='ad'>广告 {i}</div>" for i in range(10)) + "</aside>"
+    return (
+        "<!DOCTYPE html><html>" + HEAD.format(title="新闻文章")
+        + f"<body><nav><ul>{NAV}</ul></nav><main><article><h1>标题</h1>{body}</article></main>"
+        + aside + FOOTER + "</body></html>"
+    )
+
+
+def listing(rng: random.Random, items: int) -> str:
+    rows = "".join(
+        f"<tr><td><a href='/item/{i}'>商品 {i}</a></td><td>${rng.randint(5, 500)}.00</td>"
+        f"<td><span class='badge'>有货</span> <em>{rng.choice(SENTENCES)}</em></td></tr>"
+        for i in range(items)
+    )
+    return (
+        "<!DOCTYPE html><html>" + HEAD.format(title="商品列表")
+        + f"<body><nav><ul>{NAV}</ul></nav><table><thead><tr><th>名称</th><th>价格</th>"
+        + f"<th>说明</th></tr></thead><tbody>{rows}</tbody></table>" + FOOTER + "</body></html>"
+    )
+
+
+def docs(rng: random.Random, sections: int) -> str:
+    body = "".join(
+        f"<section id='s{i}'><h2>第 {i} 节</h2><p>{_paragraph(rng)}</p>"
+        f"<pre><code>result = search(&quot;query {i}&quot;)\nprint(result)</code></pre>"
+        f"<ul>{''.join(f'<li>{rng.choice(SENTENCES)}</li>' for _ in range(4))}</ul></section>"
+        for i in range(sections)
+    )
+    toc = "".join(f"<li><a href='#s{i}'>第 {i} 节</a></li>" for i in range(sections))
+    return (
+        "<!DOCTYPE html><html>" + HEAD.format(title="文档")
+        + f"<body><aside><ol>{toc}</ol></aside><div class='content'>{body}</div>"
+        + FOOTER + "</body></html>"
+    )
+
+
+def portal(rng: random.Random, blocks: int) -> str:
+    # 深层嵌套的 div、大量内联脚本和链接
+    body = "".join(
+        "<div class='card'><div class='inner'><div class='title'>"
+        f"<a href='https://news.example.com/{rng.randint(0, 99999)}'>{rng.choice(SENTENCES)}</a>"
+        f"</div><div class='meta'><span>{rng.randint(1, 59)} 分钟前</span></div></div>"
+        f"<script>track({i});</script></div>"
+        for i in range(blocks)
+    )
+    return (
+        "<!DOCTYPE html><html>" + HEAD.format(title="门户首页")
+        + f"<body><nav><ul>{NAV * 3}</ul></nav><div id='feed'>{body}</div>" + FOOTER + "</body></html>"
+    )
+
+
+def generate(seed: int = 0) -> List[Tuple[str, str]]:
+    """返回 [(名称, html), ...]，每类页面各有小、中、大三种规模"""
+    rng = random.Random(seed)
+    pages = []
+    for name, make, sizes in (
+        ("article", article, (20, 200, 2000)),
+        ("listing", listing, (50, 500, 3000)),
+        ("docs", docs, (10, 100, 600)),
+        ("portal", portal, (50, 500, 3000)),
+    ):
+        for size in sizes:
+            pages.append((f"{name}-{size}", make(rng, size)))
+    return pages
+
+
+def load(directory: str) -> List[Tuple[str, str]]:
+    """读取目录中保存的真实网页"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
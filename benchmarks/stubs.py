@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+"""
+基准测试用的本地替身服务
+
+- FakeOpenRouter: 模拟 chat/completions 接口，可配置首字节延迟、推理内容长度和输出速度，
+  支持 SSE 流式输出；按任务逐轮返回脚本化的 JSON 响应
+- FakeTavily: 模拟 Tavily /search 接口，结果指向本地静态站点（支持 include_raw_content）
+- StaticSite: 用夹具语料提供真实感的网页，另有超大页面（/huge）和慢速主机（/slow/...）
+
+三个服务各自监听一个端口，用法:
+    async with StubServers(llm_latency=0.2) as stubs:
+        os.environ["API_BASE_URL"] = stubs.llm_url
+        ...
+"""
+
+import asyncio
+import json
+import random
+import re
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+import fixtures
+
+TASK_PATTERN = re.compile(r"任务：\s*```\s*(.*?)\s*```", re.DOTALL)
+BLOCK_PATTERN = re.compile(r"<([a-z]{3}-\d{3})>(.*?)</\1>", re.DOTALL)
+URL_PATTERN = re.compile(r"https?://\S+")
+
+
+class StaticSite:
+    """静态网页服务：/page/<名称>、/huge（超大页面）、/slow/<名称>（分块慢速返回）"""
+
+    def __init__(self, huge_mb: float = 8.0, slow_seconds: float = 2.0, seed: int = 0) -> None:
+        self.pages = dict(fixtures.generate(seed))
+        self.huge_mb = huge_mb
+        self.slow_seconds = slow_seconds
+        self._huge: Optional[bytes] = None
+
+    def paths(self) -> List[str]:
+        """所有可抓取的路径（普通页面 + 超大页面 + 一个慢速页面）"""
+        names = sorted(self.pages)
+        return [f"/page/{name}" for name in names] + ["/huge", f"/slow/{names[0]}"]
+
+    def huge(self) -> bytes:
+        if self._huge is None:
+            rng = random.Random(1)
+            paragraphs = []
+            size = 0
+            while size < self.huge_mb * 1024 * 1024:
+                paragraph = f"<p>{fixtures._paragraph(rng)}</p>"
+                paragraphs.append(paragraph)
+                size += len(paragraph.encode("utf-8"))
+            self._huge = (
+                "<!DOCTYPE html><html><head><meta charset='utf-8'><title>超大页面</title></head><body>"
+                + "".join(paragraphs) + "</body></html>"
+            ).encode("utf-8")
+        return self._huge
+
+    async def page(self, request: web.Request) -> web.Response:
+        html = self.pages.get(request.match_info["name"])
+        if html is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=html, content_type="text/html", charset="utf-8")
+
+    async def huge_page(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.huge(), content_type="text/html", charset="utf-8")
+
+    async def slow_page(self, request: web.Request) -> web.StreamResponse:
+        html = self.pages.get(request.match_info["name"])
+        if html is None:
+            raise web.HTTPNotFound()
+        body = html.encode("utf-8")
+        response = web.StreamResponse(headers={"Content-Type": "text/html; charset=utf-8"})
+        await response.prepare(request)
+        # 把页面分成 10 块，在 slow_seconds 内逐块发送
+        step = max(1, len(body) // 10 + 1)
+        for i in range(0, len(body), step):
+            await asyncio.sleep(self.slow_seconds / 10)
+            await response.write(body[i:i + step])
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/page/{name}", self.page)
+        app.router.add_get("/huge", self.huge_page)
+        app.router.add_get("/slow/{name}", self.slow_page)
+        return app
+
+
+class FakeTavily:
+    """模拟 Tavily 搜索：固定延迟，返回 max_results 条指向静态站点的结果"""
+
+    def __init__(self, site: StaticSite, latency: float = 0.3) -> None:
+        self.site = site
+        self.latency = latency
+        self.site_url = ""
+        self.calls = 0
+
+    async def search(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        names = sorted(self.site.pages)
+        results = []
+        for i in range(int(data.get("max_results") or 5)):
+            name = names[(self.calls + i) % len(names)]
+            result = {
+                "url": f"{self.site_url}/page/{name}",
+                "title": f"{data['query']} - {name}",
+                "content": " ".join(fixtures.SENTENCES[: 2 + i % 3]),
+            }
+            if data.get("include_raw_content"):
+                result["raw_content"] = self.site.pages[name]
+            results.append(result)
+        return web.json_response({"query": data["query"], "results": results})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/search", self.search)
+        return app
+
+
+class FakeOpenRouter:
+    """
+    模拟 OpenRouter chat/completions
+
+    每个任务（按提示词中的任务文本区分）独立计数轮次，第 n 次调用返回 script[n]（超出时用最后一项）；
+    不指定 script 时生成 rounds 轮的默认脚本：前几轮各发起一次搜索和两次抓取，最后一轮完成。
+    工作区压缩请求返回机械合并的记忆块；其他请求（例如 BreakPrompt 总结）返回一段固定的总结。
+
+    延迟模型：latency 秒后返回首字节，之后按 chars_per_second 输出推理内容和回答（0 表示不限速）。
+    """
+
+    def __init__(
+        self,
+        site: StaticSite,
+        latency: float = 0.5,
+        reasoning_chars: int = 2000,
+        chars_per_second: float = 0,
+        rounds: int = 3,
+        script: Optional[List[Dict[str, Any]]] = None,
+        chunk_chars: int = 32,
+    ) -> None:
+        self.site = site
+        self.latency = latency
+        self.reasoning_chars = reasoning_chars
+        self.chars_per_second = chars_per_second
+        self.rounds = rounds
+        self.script = script
+        self.chunk_chars = chunk_chars
+        self.site_url = ""
+        self._rounds: Dict[str, int] = {}
+        self.calls = 0
+
+    def scripted(self, task: str, round_index: int) -> Dict[str, Any]:
+        if self.script:
+            return self.script[min(round_index, len(self.script) - 1)]
+        paths = self.site.paths()
+        # 不同任务从不同页面开始，避免所有任务总是抓取同一批页面
+        offset = sum(map(ord, task)) % len(paths)
+        if round_index + 1 >= self.rounds:
+            return {
+                "status_update": "已完成",
+                "memory_updates": [],
+                "tool_calls": [],
+                "answer": f"基准测试答案：{task[:20]}",
+                "important_links": [
+                    {"url": self.site_url + paths[offset], "title": "基准测试页面"}
+                ],
+            }
+        urls = [
+            self.site_url + paths[(offset + round_index * 2 + i) % len(paths)] for i in range(2)
+        ]
+        return {
+            "status_update": "进行中",
+            "memory_updates": [
+                {"operation": "add", "content": f"第 {round_index + 1} 轮发现的线索：{url}"}
+                for url in urls
+            ],
+            "tool_calls": [{"tool": "search", "input": f"{task[:20]} 第 {round_index + 1} 轮"}]
+            + [{"tool": "scrape", "input": url} for url in urls],
+            "answer": "",
+            "important_links": [],
+        }
+
+    @staticmethod
+    def compact(prompt: str) -> str:
+        """模拟工作区压缩：每三个块合并为一个，每个块只保留开头和其中的 URL"""
+        section = prompt.rsplit("需要整理的记忆块：", 1)[1]
+        contents = [
+            URL_PATTERN.sub("", content)[:24] + " " + " ".join(URL_PATTERN.findall(content))
+            for _, content in BLOCK_PATTERN.findall(section)
+        ]
+        blocks = ["；".join(contents[i:i + 3]) for i in range(0, len(contents), 3)]
+        return "```json\n" + json.dumps({"blocks": blocks}, ensure_ascii=False) + "\n```"
+
+    def respond(self, prompt: str) -> str:
+        if "需要整理的记忆块：" in prompt:
+            return self.compact(prompt)
+        match = TASK_PATTERN.search(prompt)
+        if match is None or "调查周期" not in prompt:
+            return "总结：根据工作区中的记忆块整理出的最终答案。"
+        task = match.group(1)
+        round_index = self._rounds.get(task, 0)
+        self._rounds[task] = round_index + 1
+        return "```json\n" + json.dumps(self.scripted(task, round_index), ensure_ascii=False) + "\n```"
+
+    def reasoning(self) -> str:
+        unit = "让我想想 {下一步} 需要调用哪些工具。"
+        return (unit * (self.reasoning_chars // len(unit) + 1))[: self.reasoning_chars]
+
+    async def _pace(self, chars: int) -> None:
+        if self.chars_per_second > 0:
+            await asyncio.sleep(chars / self.chars_per_second)
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        self.calls += 1
+        prompt = data["messages"][-1]["content"]
+        content = self.respond(prompt)
+        reasoning = self.reasoning()
+        usage = {
+            "prompt_tokens": len(prompt) // 2,
+            "completion_tokens": (len(reasoning) + len(content)) // 2,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        await asyncio.sleep(self.latency)
+
+        if not data.get("stream"):
+            await self._pace(len(reasoning) + len(content))
+            return web.json_response(
+                {
+                    "choices": [{"message": {"reasoning": reasoning, "content": content}}],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for field, text in (("reasoning", reasoning), ("content", content)):
+            for i in range(0, len(text), self.chunk_chars):
+                piece = text[i:i + self.chunk_chars]
+                await self._pace(len(piece))
+                chunk = {"choices": [{"delta": {field: piece}}]}
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/api/v1/chat/completions", self.chat)
+        return app
+
+
+class StubServers:
+    """在本机随机端口上启动三个替身服务"""
+
+    def __init__(
+        self,
+        llm_latency: float = 0.5,
+        reasoning_chars: int = 2000,
+        chars_per_second: float = 0,
+        rounds: int = 3,
+        script: Optional[List[Dict[str, Any]]] = None,
+        search_latency: float = 0.3,
+        huge_mb: float = 8.0,
+        slow_seconds: float = 2.0,
+    ) -> None:
+        self.site = StaticSite(huge_mb=huge_mb, slow_seconds=slow_seconds)
+        self.tavily = FakeTavily(self.site, latency=search_latency)
+        self.llm = FakeOpenRouter(
+            self.site,
+            latency=llm_latency,
+            reasoning_chars=reasoning_chars,
+            chars_per_second=chars_per_second,
+            rounds=rounds,
+            script=script,
+        )
+        self._runners: List[web.AppRunner] = []
+        self.site_url = self.tavily_url = self.llm_url = ""
+
+    async def _start(self, app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self._runners.append(runner)
+        host, port = runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def start(self) -> "StubServers":
+        # 提前生成超大页面，生成时间不计入抓取延迟
+        self.site.huge()
+        self.site_url = await self._start(self.site.app())
+        self.tavily_url = await self._start(self.tavily.app())
+        self.llm_url = await self._start(self.llm.app()) + "/api/v1/chat/completions"
+        self.tavily.site_url = self.llm.site_url = self.site_url
+        return self
+
+    async def close(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners.clear()
+
+    async def __aenter__(self) -> "StubServers":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
@@ -1,11 +1,16 @@
+import logging
 import os
 
 from llm import OpenRouterModel
+from http_client import HttpClient
+from metrics import metrics
 from dotenv import load_dotenv
 
 # 加载.env文件中的环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 PROMPT = """
 你是一个可以总结和归纳的AI，请根据以下内容，总结出最核心的内容，并给出总结后的内容。
 比如下面是返回内容：
@@ -50,12 +55,54 @@ Memory:
 """
 
 class BreakPrompt():
-    def __init__(self):
-        self.model = OpenRouterModel(api_key=os.getenv("OPENROUTER_API_KEY"))
+    def __init__(self, http: HttpClient | None = None):
+        self.model = OpenRouterModel(api_key=os.getenv("OPENROUTER_API_KEY"), http=http)
 
     async def run(self, content: str):
         try:
-            return await self.model(PROMPT.format(content=content))
-        except Exception as e:
-            print(e)
-            raise
\ No newline at end of file
+            with metrics.span("summary"):
+                return await self.model(PROMPT.format(content=content))
+        except Exception:
+            logger.exception("总结失败")
+            raise
+
+COMPACT_PROMPT = """
+你是一个整理调查笔记的助手。下面是一个信息调查代理的记忆块，格式为 <id>内容</id>。
+记忆块太多太长了，请把它们整理成更少、更精炼的块，总长度控制在大约 {target_chars} 个字符以内：
+
+- 合并内容相关或重复的块，删除已被更新的旧信息
+- 保留所有事实、数字、日期、待调查的线索和信息缺口
+- 所有 URL 必须原样保留，写在它所支持的信息旁边
+- 不要编造任何信息，不要加入记忆块中没有的内容
+
+以 JSON 格式返回整理后的记忆块内容（不需要 id）：
+```json
+{{"blocks": ["整理后的第一个块", "整理后的第二个块"]}}
+```
+
+需要整理的记忆块：
+```
+{blocks}
+```
+"""
+
+
+class CompactPrompt():
+    """
+    工作区压缩：与 BreakPrompt 使用同样的模型调用方式，可以用 COMPACTION_MODEL 指定更便宜的模型
+    """
+
+    def __init__(self, http: HttpClient | None = None):
+        self.model = OpenRouterModel(
+            model_name=os.getenv("COMPACTION_MODEL") or None,
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            http=http,
+        )
+
+    async def run(self, blocks: str, target_chars: int) -> str:
+        try:
+            with metrics.span("compaction"):
+                return await self.model(COMPACT_PROMPT.format(blocks=blocks, target_chars=target_chars))
+        except Exception:
+            logger.exception("压缩工作区失败")
+            raise
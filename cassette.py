@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+
+class CassetteMiss(Exception):
+    """回放模式下找不到对应的录制记录"""
+
+
+class Cassette:
+    """
+    LLM 和工具调用的录制/回放
+
+    - record: 正常调用，并把每次的请求摘要和响应追加写入磁盘
+    - replay: 不访问网络，直接返回录制的响应；找不到时抛出 CassetteMiss
+    - off: 不做任何处理
+
+    文件格式为 gzip 压缩的 JSON Lines，每行一条记录：
+    {"kind": "llm" | "search" | "scrape" | "meta", "key": "...", "value": ...}
+    键是 kind 加请求内容（渲染后的提示词 / 工具输入）的 sha256。
+    """
+
+    def __init__(self, path: str | None = None, mode: str | None = None) -> None:
+        self.path = path or os.getenv("CASSETTE_PATH", ".cache/cassette.jsonl.gz")
+        self.mode = (mode or os.getenv("CASSETTE_MODE", "off")).lower()
+        if self.mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {self.mode}")
+        self.entries: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        if self.mode != "off" and os.path.exists(self.path):
+            self._load()
+
+    @property
+    def active(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def key(kind: str, payload: Dict[str, Any]) -> str:
+        raw = json.dumps({"kind": kind, **payload}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    self.entries[record["key"]] = record["value"]
+
+    def _append(self, kind: str, key: str, value: Any) -> None:
+        self.entries[key] = value
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps({"kind": kind, "key": key, "value": value}, ensure_ascii=False)
+        # 每条记录单独追加为一个 gzip 成员，进程中途退出也不会损坏已写入的内容
+        with self._lock, gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def wrap(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        call: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """按当前模式执行 call、录制其结果或直接回放"""
+        if self.mode == "off":
+            return await call()
+
+        key = self.key(kind, payload)
+        if self.mode == "replay":
+            if key not in self.entries:
+                raise CassetteMiss(f"No recorded {kind} response for key {key[:12]}")
+            return self.entries[key]
+
+        result = await call()
+        self._append(kind, key, result)
+        return result
+
+    def record(self, kind: str, payload: Dict[str, Any], value: Any) -> None:
+        """
+        录制模式下直接写入一条记录，用于 call 被外部取消、wrap() 来不及录制的情况
+        （例如工具调用超过本轮截止时间），回放时同一个键返回 value
+        """
+        if self.mode == "record":
+            self._append(kind, self.key(kind, payload), value)
+
+    def meta(self, name: str, value: Any = None) -> Any:
+        """
+        读写会话级元数据（例如任务日期），保证回放时渲染出相同的提示词
+
+        录制模式下写入 value 并返回；回放模式下返回录制的值（不存在时返回 value）。
+        """
+        key = self.key("meta", {"name": name})
+        if self.mode == "replay":
+            return self.entries.get(key, value)
+        if self.mode == "record" and self.entries.get(key) != value:
+            self._append("meta", key, value)
+        return value
+
+
+_cassette: Cassette | None = None
+
+
+def get_cassette() -> Cassette:
+    """返回进程级共享的 cassette（由 CASSETTE_MODE / CASSETTE_PATH 配置）"""
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette()
+    return _cassette
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, TypedDict
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(TypedDict):
+    task_id: str
+    task: str
+    current_date: str
+    round: int
+    state: Dict[str, Any]
+    tool_records: Optional[List[Dict[str, Any]]]
+    timings: List[Dict[str, Any]]
+    llm_calls: List[Dict[str, Any]]
+    elapsed: float
+    saved_at: float
+
+
+def make_task_id(task: str) -> str:
+    """未指定任务 ID 时，以任务文本的哈希作为 ID（同一任务重新提交时可以找到之前的检查点）"""
+    return hashlib.sha1(task.encode("utf-8")).hexdigest()[:12]
+
+
+class CheckpointStore:
+    """
+    Agent 的逐轮检查点（SQLite）
+
+    每个任务只保留最新一轮的检查点：工作区状态、上一轮的工具结果、轮次、任务和日期，
+    压缩后在一个事务中整行替换，进程在写入途中退出也不会留下不完整的检查点。
+    超过 ttl 秒未更新的检查点在打开数据库时清理。
+    """
+
+    def __init__(self, path: str | None = None, ttl: float | None = None) -> None:
+        self.path = path or os.getenv("CHECKPOINT_PATH", ".cache/checkpoints.sqlite3")
+        self.ttl = ttl if ttl is not None else float(os.getenv("CHECKPOINT_TTL", str(7 * 86400)))
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    task_id TEXT PRIMARY KEY,
+                    round INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    saved_at REAL NOT NULL
+                )
+                """
+            )
+            if self.ttl > 0:
+                conn.execute("DELETE FROM checkpoints WHERE saved_at < ?", (time.time() - self.ttl,))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def encode(checkpoint: Checkpoint) -> bytes:
+        return zlib.compress(json.dumps(checkpoint, ensure_ascii=False).encode("utf-8"))
+
+    def save(self, checkpoint: Checkpoint, data: bytes | None = None) -> None:
+        """写入检查点；data 为 encode() 的结果，调用方已经编码过时传入以免重复序列化"""
+        if data is None:
+            data = self.encode(checkpoint)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints (task_id, round, status, data, saved_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        checkpoint["task_id"],
+                        checkpoint["round"],
+                        checkpoint["state"]["status"],
+                        data,
+                        checkpoint["saved_at"],
+                    ),
+                )
+        logger.debug(
+            "已保存检查点 %s 第 %d 轮（%d 字节）", checkpoint["task_id"], checkpoint["round"], len(data)
+        )
+
+    def load(self, task_id: str) -> Optional[Checkpoint]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data FROM checkpoints WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM checkpoints WHERE task_id = ?", (task_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_checkpoint_store: CheckpointStore | None = None
+
+
+def get_checkpoint_store() -> CheckpointStore | None:
+    """返回进程级共享的检查点存储；CHECKPOINT=off 时禁用"""
+    global _checkpoint_store
+    if os.getenv("CHECKPOINT", "on").lower() in ("off", "0", "false", "no"):
+        return None
+    if _checkpoint_store is None:
+        _checkpoint_store = CheckpointStore()
+    return _checkpoint_store
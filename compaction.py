@@ -0,0 +1,87 @@
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from break_prompt import CompactPrompt
+from llm import estimate_tokens
+from metrics import metrics
+from tools import extract_largest_json
+from urls import find_urls
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("deepsearch_compactions_total", "工作区压缩次数（按结果）")
+
+
+class WorkspaceCompactor:
+    """
+    工作区记忆块的压缩
+
+    模型经常忘记删除过时的块，记忆块只增不减，每轮提示词都要完整地带上它们。
+    记忆块的 token 数超过 max_tokens 时，用一次廉价的模型调用把所有块合并整理到
+    大约 target_share * max_tokens，并检查原有的 URL 都还在（缺失的 URL 补成一个单独的块）。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        target_share: float | None = None,
+        prompt: CompactPrompt | None = None,
+    ) -> None:
+        self.max_tokens = (
+            max_tokens if max_tokens is not None else int(os.getenv("WORKSPACE_MAX_TOKENS", "6000"))
+        )
+        self.target_share = (
+            target_share
+            if target_share is not None
+            else float(os.getenv("WORKSPACE_COMPACT_TARGET", "0.5"))
+        )
+        self.prompt = prompt or CompactPrompt()
+
+    @staticmethod
+    def render(blocks: Dict[str, str]) -> str:
+        return "\n".join(f"<{block_id}>{content}</{block_id}>" for block_id, content in blocks.items())
+
+    def needed(self, blocks: Dict[str, str]) -> bool:
+        # 块太少时合并不出什么，通常是单个块本身过长，交给 PromptBudget 裁剪
+        return self.max_tokens > 0 and len(blocks) > 2 and estimate_tokens(self.render(blocks)) > self.max_tokens
+
+    async def compact(self, blocks: Dict[str, str]) -> Optional[List[str]]:
+        """
+        返回整理后的块内容列表；模型输出无法解析或没有明显变小时返回 None
+        """
+        text = self.render(blocks)
+        before = estimate_tokens(text)
+        # 按原文的字符/token 比例换算成字符数，模型对字符数的感知比 token 数准确
+        target_chars = int(len(text) * self.max_tokens * self.target_share / before)
+        response = await self.prompt.run(text, target_chars)
+        response = re.sub(r"(?:<think>)?.*?</think>", "", response, flags=re.DOTALL)
+        parsed = extract_largest_json(response)
+        contents = parsed.get("blocks") if isinstance(parsed, dict) else None
+        if not isinstance(contents, list):
+            logger.warning("无法解析压缩结果: %s...", response[:200])
+            metrics.inc("deepsearch_compactions_total", result="invalid")
+            return None
+        contents = [str(content).strip() for content in contents if str(content).strip()]
+
+        compacted = "\n".join(contents)
+        missing = [url for url in find_urls(text) if url not in compacted]
+        if missing:
+            contents.append("压缩前记录的来源链接：\n" + "\n".join(missing))
+
+        after = estimate_tokens(self.render({str(i): content for i, content in enumerate(contents)}))
+        if not contents or after > before * 0.9:
+            logger.info("压缩结果没有明显变小（%d -> %d tokens），保留原记忆块", before, after)
+            metrics.inc("deepsearch_compactions_total", result="rejected")
+            return None
+        logger.info(
+            "工作区压缩：%d 个块 %d tokens -> %d 个块 %d tokens（补回 %d 个 URL）",
+            len(blocks), before, len(contents), after, len(missing),
+        )
+        return contents
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from metrics import STAGE_BUCKETS, LatencyHistogram, metrics, render_counters
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+metrics.describe("deepsearch_llm_failovers_total", "LLM 请求失败后切换到下一个端点的次数")
+metrics.describe("deepsearch_llm_hedges_total", "LLM 对冲请求次数（按先返回的一方）")
+
+
+class CircuitBreaker:
+    """
+    单个端点的熔断器
+
+    连续失败 failures 次后断开 reset_timeout 秒，期间不再向该端点发请求；
+    到期后进入半开状态，只放行一个试探请求，成功则恢复，失败则再次断开。
+    """
+
+    def __init__(self, failures: int | None = None, reset_timeout: float | None = None) -> None:
+        self.failures = failures if failures is not None else int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+        self.reset_timeout = (
+            reset_timeout if reset_timeout is not None else float(os.getenv("LLM_BREAKER_RESET", "30"))
+        )
+        self.consecutive = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if time.monotonic() < self.open_until:
+            return "open"
+        return "half_open" if self.open_until else "closed"
+
+    def remaining(self) -> float:
+        """距离可以再次尝试还需等待的秒数"""
+        return max(0.0, self.open_until - time.monotonic())
+
+    def allow(self) -> bool:
+        """是否可以向该端点发请求；半开状态下只有第一个调用者获得试探机会"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive = 0
+            self.open_until = 0.0
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive += 1
+            if self.probing or self.consecutive >= self.failures:
+                self._open(self.reset_timeout)
+
+    def release(self) -> None:
+        """试探请求被取消（既没有成功也没有失败）时归还试探机会"""
+        with self._lock:
+            self.probing = False
+
+    def open_for(self, seconds: float) -> None:
+        """端点要求暂停（429 Retry-After）时直接断开指定的时间"""
+        with self._lock:
+            self._open(seconds)
+
+    def _open(self, seconds: float) -> None:
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+        self.probing = False
+        self.opened += 1
+
+
+class Endpoint:
+    """
+    一个模型端点（URL + 模型名）
+
+    进程内相同 URL 和模型名的端点共享熔断器和延迟统计，见 get_endpoint()。
+    延迟按是否流式分开统计：流式记录首 token 延迟，非流式记录完整响应的耗时，
+    对冲请求的等待时间取其中的高分位数。
+    """
+
+    def __init__(self, model_name: str, base_url: str) -> None:
+        self.model_name = model_name
+        self.base_url = base_url
+        self.name = f"{model_name}@{urlparse(base_url).netloc or base_url}"
+        self.breaker = CircuitBreaker()
+        self.latency = {
+            "stream": LatencyHistogram(STAGE_BUCKETS),
+            "full": LatencyHistogram(STAGE_BUCKETS),
+        }
+
+    def observe(self, stream: bool, seconds: float) -> None:
+        self.latency["stream" if stream else "full"].observe(seconds)
+
+    def hedge_delay(self, stream: bool) -> float | None:
+        """观测到的延迟高分位数；样本不足时返回 None（不发对冲请求）"""
+        histogram = self.latency["stream" if stream else "full"]
+        if histogram.count < int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")):
+            return None
+        quantile = histogram.quantile(float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")))
+        return max(float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")), quantile or 0.0)
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name}, {self.breaker.state})"
+
+
+_endpoints: Dict[Tuple[str, str], Endpoint] = {}
+_endpoints_lock = threading.Lock()
+
+
+def get_endpoint(model_name: str, base_url: str) -> Endpoint:
+    """返回进程级共享的端点（同一端点的所有 OpenRouterModel 看到同一个熔断状态）"""
+    key = (base_url, model_name)
+    with _endpoints_lock:
+        endpoint = _endpoints.get(key)
+        if endpoint is None:
+            endpoint = _endpoints[key] = Endpoint(model_name, base_url)
+        return endpoint
+
+
+def parse_endpoints(value: str, base_url: str) -> List[Endpoint]:
+    """
+    解析 LLM_ENDPOINTS：逗号分隔，每项为 "模型名" 或 "模型名@URL"，省略 URL 时使用 base_url
+
+    例如 "deepseek/deepseek-r1:free, qwen/qwq-32b:free, deepseek-reasoner@https://api.example.com/v1/chat/completions"，
+    所有端点使用同一个 API 密钥
+    """
+    endpoints = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model_name, _, url = item.partition("@")
+        endpoints.append(get_endpoint(model_name.strip(), url.strip() or base_url))
+    return endpoints
+
+
+def _breaker_metrics() -> List[str]:
+    with _endpoints_lock:
+        endpoints = list(_endpoints.values())
+    return render_counters(
+        "deepsearch_llm_breaker_opened_total",
+        "LLM 端点熔断次数",
+        {(("endpoint", endpoint.name),): endpoint.breaker.opened for endpoint in endpoints},
+    )
+
+
+metrics.register(_breaker_metrics)
@@ -0,0 +1,324 @@
+import codecs
+import io
+import json
+import logging
+import os
+import re
+from typing import List, Tuple
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 可选的快速解析器：selectolax（lexbor）优先，其次 lxml，都未安装时使用 BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = lxml_html = None
+
+# PDF 文本提取（纯 Python 实现），未安装时拒绝 PDF
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# 响应头和 meta 标签都没有声明编码、且不是 UTF-8 时用于猜测编码
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+# 不可见的元素，整个子树都不参与提取
+INVISIBLE_TAGS = frozenset(["script", "style", "noscript", "template", "svg", "canvas", "iframe"])
+# 导航、页脚、侧栏等模板内容：不计入正文，但其中的链接仍然保留（Agent 可以据此继续浏览）
+BOILERPLATE_TAGS = frozenset(["nav", "footer", "aside"])
+SKIP_TAGS = INVISIBLE_TAGS | BOILERPLATE_TAGS
+
+# 块级元素的边界处插入换行，避免相邻段落的文字粘在一起
+BLOCK_TAGS = frozenset(
+    [
+        "address", "article", "blockquote", "br", "dd", "details", "dialog", "div", "dl", "dt",
+        "fieldset", "figcaption", "figure", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+        "hr", "li", "main", "ol", "p", "pre", "section", "summary", "table", "tbody", "td",
+        "tfoot", "th", "thead", "title", "tr", "ul",
+    ]
+)
+
+_IGNORED_SCHEMES = ("#", "javascript:", "mailto:", "tel:", "data:")
+
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+# 已解码文本开头的 XML 声明（<?xml version="1.0" encoding="..."?>），libxml2 不接受带编码声明的 str
+_XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+# 声明为 GB2312/GBK 的中文页面经常混有超出该字符集的字符，统一按超集 GB18030 解码
+_CHARSET_ALIASES = {"gb2312": "gb18030", "gbk": "gb18030", "x-gbk": "gb18030"}
+
+# 交给 HTML 提取器的文档类型；image/svg+xml 等其他 +xml 类型不是文档，直接拒绝
+HTML_TYPES = frozenset(
+    [
+        "text/html",
+        "application/xhtml+xml",
+        "application/xml",
+        "text/xml",
+        "application/rss+xml",
+        "application/atom+xml",
+    ]
+)
+JSON_TYPES = frozenset(["application/json", "text/json"])
+PDF_TYPES = frozenset(["application/pdf"])
+# 未声明类型或声明为通用二进制时，根据内容开头判断
+SNIFF_TYPES = frozenset(["", "application/octet-stream", "binary/octet-stream"])
+
+Links = List[Tuple[str, str]]
+
+
+def clean_text(text: str) -> str:
+    """清理文本（删除多余空行和空格）"""
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(chunk for chunk in chunks if chunk)
+
+
+def resolve_link(href: str, base_url: str) -> str | None:
+    """把相对链接转换为绝对 URL；页内锚点、javascript:、mailto: 等返回 None"""
+    href = href.strip()
+    if not href or href.lower().startswith(_IGNORED_SCHEMES):
+        return None
+    return urljoin(base_url, href)
+
+
+def content_kind(content_type: str) -> str | None:
+    """
+    根据 Content-Type 判断内容类别：html、text、json、pdf、unknown（需要读取内容判断）
+
+    返回 None 表示不是文本内容（图片、音视频、压缩包等），应当在读取响应体之前拒绝。
+    """
+    content_type = (content_type or "").lower()
+    if content_type in HTML_TYPES:
+        return "html"
+    if content_type in JSON_TYPES or content_type.endswith("+json"):
+        return "json"
+    if content_type in PDF_TYPES:
+        return "pdf"
+    if content_type.startswith("text/"):
+        return "text"
+    if content_type in SNIFF_TYPES:
+        return "unknown"
+    return None
+
+
+def sniff_kind(head: bytes) -> str | None:
+    """根据内容开头判断类别，用于未声明 Content-Type 的响应"""
+    stripped = head.lstrip()
+    if stripped.startswith(b"%PDF-"):
+        return "pdf"
+    if b"\x00" in head:
+        # 文本内容（UTF-16 除外）不会包含 NUL 字节
+        return None
+    if stripped[:1] == b"<":
+        return "html"
+    if stripped[:1] in (b"{", b"["):
+        return "json"
+    return "text"
+
+
+def decode_body(body: bytes, charset: str | None = None, html: bool = False) -> str:
+    """
+    把响应体解码为文本
+
+    依次使用：BOM、响应头中的 charset、HTML 的 <meta charset>、UTF-8，
+    最后用 charset_normalizer 猜测（未安装时按 UTF-8 替换非法字节）。
+    """
+    if body.startswith(codecs.BOM_UTF8):
+        return body[len(codecs.BOM_UTF8):].decode("utf-8", errors="replace")
+    if not charset and html:
+        match = _META_CHARSET.search(body[:4096])
+        if match:
+            charset = match.group(1).decode("ascii")
+    if charset:
+        charset = _CHARSET_ALIASES.get(charset.lower(), charset)
+        try:
+            return body.decode(charset, errors="replace")
+        except LookupError:
+            pass
+    try:
+        return body.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # 按字节上限截断时，末尾可能是不完整的多字节字符
+        if e.start >= len(body) - 3:
+            return body.decode("utf-8", errors="ignore")
+    if charset_normalizer is not None:
+        best = charset_normalizer.from_bytes(body[:65536]).best()
+        if best is not None:
+            return body.decode(best.encoding, errors="replace")
+    return body.decode("utf-8", errors="replace")
+
+
+def extract_json(source: str) -> str:
+    """JSON 重新缩进以便阅读，解析失败时按纯文本处理"""
+    try:
+        return json.dumps(json.loads(source), ensure_ascii=False, indent=1)
+    except ValueError:
+        return clean_text(source)
+
+
+def extract_pdf(body: bytes, max_pages: int) -> str:
+    """用 pypdf 提取前 max_pages 页的文本"""
+    reader = PdfReader(io.BytesIO(body))
+    pages = reader.pages
+    text = clean_text("\n".join(page.extract_text() or "" for page in pages[:max_pages]))
+    if len(pages) > max_pages:
+        text += f"\n（共 {len(pages)} 页，仅提取了前 {max_pages} 页）"
+    return text
+
+
+def _add_link(links: Links, text: str, href: str | None, base_url: str) -> None:
+    if not href:
+        return
+    text = " ".join(text.split())
+    url = resolve_link(href, base_url)
+    if text and url:
+        links.append((text, url))
+
+
+class SelectolaxExtractor:
+    """lexbor（C 实现）解析；链接用 CSS 选择器取得，跳过的元素在 C 层移除后一次遍历取正文"""
+
+    name = "selectolax"
+
+    def extract(self, html: str, url: str) -> Tuple[str, Links]:
+        tree = LexborHTMLParser(html)
+        if tree.root is None:
+            return "", []
+
+        links: Links = []
+        for node in tree.css("a[href]"):
+            if not _has_ancestor(node, INVISIBLE_TAGS):
+                _add_link(links, node.text(deep=True), node.attributes.get("href"), url)
+
+        tree.strip_tags(list(SKIP_TAGS))
+        parts = []
+        for node in tree.root.traverse(include_text=True):
+            tag = node.tag
+            if tag == "-text":
+                prev = node.prev
+                if prev is not None and prev.tag in BLOCK_TAGS:
+                    parts.append("\n")
+                parts.append(node.text_content or "")
+            elif tag in BLOCK_TAGS:
+                parts.append("\n")
+        return clean_text("".join(parts)), links
+
+
+def _has_ancestor(node, tags) -> bool:
+    parent = node.parent
+    while parent is not None:
+        if parent.tag in tags:
+            return True
+        parent = parent.parent
+    return False
+
+
+class LxmlExtractor:
+    """libxml2 解析，注释在解析阶段丢弃；iterwalk 一次遍历取正文和链接，跳过的元素不进入其子树"""
+
+    name = "lxml"
+
+    def __init__(self) -> None:
+        self.parser = lxml_html.HTMLParser(remove_comments=True, remove_pis=True)
+
+    def extract(self, html: str, url: str) -> Tuple[str, Links]:
+        # XHTML 和 XML 页面常以带编码声明的 XML 声明开头，文本已经解码过，去掉即可
+        html = _XML_DECLARATION.sub("", html, count=1)
+        try:
+            root = lxml_html.document_fromstring(html, parser=self.parser)
+        except etree.ParserError:
+            # 空文档
+            return "", []
+        except ValueError:
+            # libxml2 拒绝的其他输入交给纯 Python 解析器
+            return SoupExtractor().extract(html, url)
+
+        parts = []
+        links: Links = []
+        walker = etree.iterwalk(root, events=("start", "end"))
+        for event, element in walker:
+            tag = element.tag
+            if event == "start":
+                if tag in SKIP_TAGS:
+                    if tag in BOILERPLATE_TAGS:
+                        for link in element.iter("a"):
+                            _add_link(links, link.text_content(), link.get("href"), url)
+                    # 子树被跳过，但仍会收到 end 事件，尾部文本在那里处理
+                    walker.skip_subtree()
+                    continue
+                if tag in BLOCK_TAGS:
+                    parts.append("\n")
+                if element.text:
+                    parts.append(element.text)
+                if tag == "a":
+                    _add_link(links, element.text_content(), element.get("href"), url)
+            else:
+                if tag in BLOCK_TAGS:
+                    parts.append("\n")
+                if element.tail:
+                    parts.append(element.tail)
+        return clean_text("".join(parts)), links
+
+
+class SoupExtractor:
+    """BeautifulSoup + html.parser（纯 Python），在未安装快速解析器时使用"""
+
+    name = "bs4"
+
+    def extract(self, html: str, url: str) -> Tuple[str, Links]:
+        soup = BeautifulSoup(html, "html.parser")
+
+        # 移除JavaScript和CSS
+        for element in soup(list(INVISIBLE_TAGS)):
+            element.extract()
+
+        # 模板内容中的链接也要保留，先收集链接再移除
+        links: Links = []
+        for link in soup.find_all("a", href=True):
+            _add_link(links, link.get_text(), link.get("href"), url)
+
+        for element in soup(list(BOILERPLATE_TAGS)):
+            element.extract()
+
+        return clean_text(soup.get_text()), links
+
+
+EXTRACTORS = {
+    "selectolax": (SelectolaxExtractor, LexborHTMLParser is not None),
+    "lxml": (LxmlExtractor, lxml_html is not None),
+    "bs4": (SoupExtractor, True),
+}
+
+
+def get_extractor(name: str | None = None):
+    """
+    按名称返回 HTML 提取器
+
+    HTML_EXTRACTOR=auto（默认，按 selectolax、lxml、bs4 的顺序选择第一个可用的）、
+    selectolax、lxml 或 bs4；指定的解析器未安装时退回 bs4。
+    """
+    name = (name or os.getenv("HTML_EXTRACTOR", "auto")).lower()
+    if name == "auto":
+        name = next(key for key, (_, available) in EXTRACTORS.items() if available)
+    extractor_class, available = EXTRACTORS.get(name, (SoupExtractor, True))
+    if not available:
+        logger.warning("HTML 解析器 %s 未安装，使用 BeautifulSoup", name)
+        extractor_class = SoupExtractor
+    return extractor_class()
@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import os
+
+import aiohttp
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+# 安装了 brotli 时才声明支持 br 压缩，否则 aiohttp 无法解码
+try:
+    import brotli  # noqa: F401
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+class HttpClient:
+    """
+    进程级共享的 aiohttp 客户端
+
+    所有 LLM 调用、搜索和网页抓取共用同一个连接池，复用 keep-alive 连接、
+    TLS 会话和 DNS 缓存。会话在首次使用时绑定到当前事件循环，
+    由应用入口负责在退出时关闭。
+    """
+
+    def __init__(
+        self,
+        limit: int | None = None,
+        limit_per_host: int | None = None,
+        dns_ttl: int | None = None,
+        keepalive_timeout: float | None = None,
+    ) -> None:
+        self.limit = limit if limit is not None else int(os.getenv("HTTP_POOL_LIMIT", "100"))
+        self.limit_per_host = (
+            limit_per_host
+            if limit_per_host is not None
+            else int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+        )
+        self.dns_ttl = dns_ttl if dns_ttl is not None else int(os.getenv("HTTP_DNS_TTL", "300"))
+        self.keepalive_timeout = (
+            keepalive_timeout
+            if keepalive_timeout is not None
+            else float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+        )
+        # 统一的超时配置（秒），各调用方按用途取用
+        self.timeouts = {
+            "default": float(os.getenv("HTTP_TIMEOUT", "60")),
+            "connect": float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+            "llm": float(os.getenv("LLM_TIMEOUT", "600")),
+            "search": float(os.getenv("SEARCH_TIMEOUT", "60")),
+            "scrape": float(os.getenv("SCRAPE_TIMEOUT", "30")),
+        }
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def timeout(self, kind: str = "default") -> aiohttp.ClientTimeout:
+        total = self.timeouts.get(kind, self.timeouts["default"])
+        return aiohttp.ClientTimeout(total=total, connect=self.timeouts["connect"])
+
+    def session(self) -> aiohttp.ClientSession:
+        """返回绑定到当前事件循环的共享会话，必要时创建"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self._session
+
+        # 旧会话属于另一个（可能已关闭的）事件循环，无法复用
+        stale, stale_loop = self._session, self._loop
+        if stale is not None and not stale.closed and stale_loop is not None:
+            if stale_loop.is_running():
+                asyncio.run_coroutine_threadsafe(stale.close(), stale_loop)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout(),
+            headers={"Accept-Encoding": ACCEPT_ENCODING},
+        )
+        self._loop = loop
+        return self._session
+
+    async def start(self) -> None:
+        self.session()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    def close_sync(self) -> None:
+        """在事件循环之外关闭会话（例如 Gradio 服务退出时）"""
+        session, loop = self._session, self._loop
+        self._session = None
+        self._loop = None
+        if session is None or session.closed or loop is None or loop.is_closed():
+            return
+
+        if loop.is_running():
+            # 事件循环运行在其他线程中（Gradio 的工作线程）
+            future = asyncio.run_coroutine_threadsafe(session.close(), loop)
+            with contextlib.suppress(Exception):
+                future.result(timeout=5)
+        else:
+            loop.run_until_complete(session.close())
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self):
+        """把连接池的生命周期绑定到一次应用运行"""
+        await self.start()
+        try:
+            yield self
+        finally:
+            await self.close()
+
+
+# 进程级共享客户端
+http_client = HttpClient()
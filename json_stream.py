@@ -0,0 +1,271 @@
+import bisect
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 字符串之外只有花括号和引号会改变扫描状态；字符串内只关心引号和反斜杠
+_STRUCTURAL = re.compile(r'[{}"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+# 合法 JSON 对象的 "{" 之后只可能是（空白加）引号或 "}"
+_OBJECT_START = re.compile(r'\{\s*["}]')
+
+_decoder = json.JSONDecoder()
+
+
+class JsonObjectScanner:
+    """
+    单遍、感知字符串字面量和转义的花括号配对扫描器
+
+    借助正则在结构字符之间跳跃，用栈配对 "{" 和 "}"，嵌套深度不限；
+    正文中未闭合的 "{" 只会留在栈中，不会影响后面的配对。
+    支持分块输入：只扫描新到的块，状态在 feed() 之间保留，坐标相对于累计的全部输入。
+    """
+
+    def __init__(self) -> None:
+        self._offset = 0
+        self._stack: List[int] = []
+        self._in_string = False
+        self._skip_next = False
+
+    def feed(self, chunk: str) -> List[Tuple[int, int]]:
+        """输入一段文本，返回本次新配对的 {...} 片段 [(start, end), ...]（内层在前）"""
+        n = len(chunk)
+        offset = self._offset
+        pos = 0
+        spans = []
+
+        if self._skip_next and n:
+            # 上一块以转义符结尾，跳过被转义的字符
+            self._skip_next = False
+            pos = 1
+
+        while pos < n:
+            if self._in_string:
+                m = _STRING_SPECIAL.search(chunk, pos)
+                if m is None:
+                    break
+                if m.group() == "\\":
+                    pos = m.end() + 1
+                    if pos > n:
+                        self._skip_next = True
+                    continue
+                self._in_string = False
+                pos = m.end()
+                continue
+
+            m = _STRUCTURAL.search(chunk, pos)
+            if m is None:
+                break
+            c = m.group()
+            pos = m.end()
+            if c == "{":
+                self._stack.append(offset + m.start())
+            elif c == "}":
+                if self._stack:
+                    spans.append((self._stack.pop(), offset + pos))
+            elif self._stack:
+                # 花括号之外的引号属于普通文本
+                self._in_string = True
+
+        self._offset += n
+        return spans
+
+
+def _decode_object(text: str, start: int) -> Optional[Tuple[Dict[str, Any], int]]:
+    try:
+        obj, end = _decoder.raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    except RecursionError:
+        # 嵌套超过解释器的递归上限，跳过这个起点，继续尝试其内部更浅的对象
+        return None
+    return (obj, end) if isinstance(obj, dict) else None
+
+
+def find_largest_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    返回 text 中最大的合法 JSON 对象
+
+    快速路径：只在可能开始一个对象的位置（"{" 后紧跟引号或 "}"）直接 raw_decode
+    （C 实现，不复制子串）；解码成功后跳过整个对象，其内部的对象一定更小，无需再试。
+    正文中的花括号大多在第一步就被排除，整体对输入长度线性。
+    """
+    best = None
+    best_size = 0
+    pos = 0
+    while True:
+        m = _OBJECT_START.search(text, pos)
+        if m is None:
+            return best
+        start = m.start()
+        decoded = _decode_object(text, start)
+        if decoded is None:
+            pos = start + 1
+            continue
+        obj, end = decoded
+        if end - start > best_size:
+            best, best_size = obj, end - start
+        pos = end
+
+
+class StreamingJsonExtractor:
+    """
+    find_largest_json_object 的分块版本
+
+    每当扫描器配对出一个 {...}，立即尝试解码，feed() 返回新出现的合法对象，
+    largest 始终是目前为止最大的一个。正文中的引号可能让扫描器对字符串边界判断失误，
+    因此 close() 会对全部输入再做一次快速路径解析作为兜底。
+    """
+
+    def __init__(self) -> None:
+        self._scanner = JsonObjectScanner()
+        self._chunks: List[str] = []
+        self._chunk_starts: List[int] = []
+        self._length = 0
+        # 已解码对象的结束位置，其内部的配对不再尝试
+        self._decoded_end = 0
+        self._largest_size = 0
+        self.largest: Optional[Dict[str, Any]] = None
+
+    def _slice(self, start: int, end: int) -> str:
+        i = bisect.bisect_right(self._chunk_starts, start) - 1
+        first = self._chunk_starts[i]
+        parts = []
+        while i < len(self._chunks) and self._chunk_starts[i] < end:
+            parts.append(self._chunks[i])
+            i += 1
+        return "".join(parts)[start - first:end - first]
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        if not chunk:
+            return []
+        self._chunks.append(chunk)
+        self._chunk_starts.append(self._length)
+        self._length += len(chunk)
+
+        objects = []
+        for start, end in self._scanner.feed(chunk):
+            if start < self._decoded_end:
+                continue
+            text = self._slice(start, end)
+            if not _OBJECT_START.match(text):
+                continue
+            decoded = _decode_object(text, 0)
+            if decoded is None:
+                continue
+            obj, size = decoded
+            self._decoded_end = start + size
+            objects.append(obj)
+            self._offer(obj, size)
+        return objects
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """输入结束，返回最大的合法对象"""
+        obj = find_largest_json_object("".join(self._chunks))
+        if obj is not None:
+            self.largest = obj
+        return self.largest
+
+    def _offer(self, obj: Dict[str, Any], size: int) -> None:
+        if size > self._largest_size:
+            self._largest_size = size
+            self.largest = obj
+
+
+class ToolCallStreamParser:
+    """
+    增量解析 Agent 的 JSON 响应
+
+    逐块输入模型输出的文本，一旦顶层对象中 "tool_calls" 数组的某个元素完整接收，
+    立即回调 on_tool_call，而不必等待 memory_updates、answer 等其余字段生成完毕。
+    解析器只跟踪括号深度和字符串状态，每个字符只扫描一次。
+    """
+
+    def __init__(
+        self,
+        on_tool_call: Callable[[Dict[str, Any]], None],
+        key: str = "tool_calls",
+    ) -> None:
+        self.on_tool_call = on_tool_call
+        self.key = key
+        self.tool_calls: List[Dict[str, Any]] = []
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self._in_tool_calls = False
+        self._item_start: Optional[int] = None
+
+    def _reset_object(self) -> None:
+        self._stack = []
+        self._last_string = None
+        self._current_key = None
+        self._in_tool_calls = False
+        self._item_start = None
+
+    def feed(self, chunk: str) -> None:
+        self._buf += chunk
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_string = buf[self._string_start:i + 1]
+                continue
+
+            if not self._stack:
+                # 顶层对象之外的文本（```json 之类）直接跳过
+                if c == "{":
+                    self._stack.append(c)
+                continue
+
+            depth = len(self._stack)
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":" and depth == 1:
+                try:
+                    self._current_key = json.loads(self._last_string or '""')
+                except json.JSONDecodeError:
+                    self._current_key = None
+            elif c == "," and depth == 1:
+                self._current_key = None
+            elif c in "{[":
+                self._stack.append(c)
+                if depth == 1 and c == "[" and self._current_key == self.key:
+                    self._in_tool_calls = True
+                elif depth == 2 and c == "{" and self._in_tool_calls:
+                    self._item_start = i
+            elif c in "}]":
+                self._stack.pop()
+                depth -= 1
+                if depth == 2 and c == "}" and self._item_start is not None:
+                    self._emit(buf[self._item_start:i + 1])
+                    self._item_start = None
+                elif depth == 1 and c == "]":
+                    self._in_tool_calls = False
+                elif depth == 0:
+                    self._reset_object()
+
+        self._pos = len(buf)
+
+    def _emit(self, text: str) -> None:
+        try:
+            call = json.loads(text)
+        except json.JSONDecodeError:
+            return
+        if isinstance(call, dict) and "tool" in call and "input" in call:
+            self.tool_calls.append(call)
+            self.on_tool_call(call)
@@ -1,15 +1,92 @@
+import asyncio
+import json
+import logging
 import os
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
 import aiohttp
 from dotenv import load_dotenv
 
+from cassette import Cassette, get_cassette
+from endpoints import Endpoint, get_endpoint, parse_endpoints
+from http_client import HttpClient, http_client
+from log_config import log_payload
+from metrics import metrics
+from rate_limiter import RateLimiter, backoff_delay, parse_retry_after, rate_limiter
+from usage import UsageTracker, make_call, record_call
+
 # 加载.env文件中的环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class LLMRequestError(Exception):
+    """模型接口的请求错误；retryable 表示退避后重试可能成功，retry_after 为服务端要求等待的秒数"""
+
+    def __init__(
+        self,
+        message: str,
+        status: int | None = None,
+        retryable: bool = True,
+        retry_after: float | None = None,
+    ) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def is_retryable_status(status: int) -> bool:
+    return status in (408, 429) or status >= 500
+
+
 class OpenRouterModel:
-    def __init__(self, model_name=None, api_key=None, base_url=None): #openai/gpt-4.1 deepseek/deepseek-r1:free
-        self.model_name = model_name or os.getenv("MODEL_NAME")
+    """
+    OpenRouter（兼容 OpenAI）聊天接口的客户端
+
+    可以配置多个端点（LLM_ENDPOINTS），按顺序使用：一个端点失败时立即切换到下一个，
+    连续失败的端点被熔断一段时间；所有端点都失败时指数退避（带抖动）后重试。
+    LLM_HEDGE=1 时，请求超过端点观测到的高分位延迟仍未返回，就向下一个端点发一份
+    相同的请求，先返回的一方胜出。
+    """
+
+    def __init__(
+        self,
+        model_name=None,
+        api_key=None,
+        base_url=None,
+        http: HttpClient | None = None,
+        cassette: Cassette | None = None,
+        limiter: RateLimiter | None = None,
+        endpoints: List[Endpoint] | None = None,
+    ): #openai/gpt-4.1 deepseek/deepseek-r1:free
         self.api_key = api_key or os.getenv("LLM_API_KEY")
         self.base_url = base_url or os.getenv("API_BASE_URL")
+        if endpoints is None:
+            configured = os.getenv("LLM_ENDPOINTS", "")
+            # 显式指定了模型或 URL 的实例（例如 COMPACTION_MODEL）只使用该端点
+            if configured and model_name is None and base_url is None:
+                endpoints = parse_endpoints(configured, self.base_url)
+            else:
+                endpoints = [get_endpoint(model_name or os.getenv("MODEL_NAME"), self.base_url)]
+        self.endpoints = endpoints
+        self.model_name = endpoints[0].model_name
+        self.http = http or http_client
+        self.cassette = cassette or get_cassette()
+        self.limiter = limiter or rate_limiter
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+        self.hedge = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes", "on")
 
     def _get_headers(self):
         return {
@@ -17,31 +94,307 @@ class OpenRouterModel:
             "Content-Type": "application/json",
         }
 
-    def _build_payload(self, messages, reasoning_effort="low"):
+    def _build_payload(self, messages, reasoning_effort="low", model_name=None):
         return {
-            "model": self.model_name,
+            "model": model_name or self.model_name,
             "messages": messages,
             "reasoning": {"effort": reasoning_effort},
+            # 让 OpenRouter 在 usage 中返回费用和推理 token 数
+            "usage": {"include": True},
         }
 
-    async def __call__(self, message: str, reasoning_effort="low"):
-        messages = [{"role": "user", "content": message}]
-        headers = self._get_headers()
-        payload = self._build_payload(messages, reasoning_effort)
+    async def __call__(
+        self,
+        message: str,
+        reasoning_effort="low",
+        on_content: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        调用模型并返回 "推理内容\n回答内容"
+
+        传入 on_content 时使用 SSE 流式输出，每收到一段回答内容（不含推理）就回调一次。
+        回放模式下直接返回录制的完整结果，不会回调 on_content，录制的用量照常记账。
+        """
+        if not self.cassette.active:
+            return await self._request(message, reasoning_effort, on_content)
+
+        async def request() -> Dict:
+            # 录制时连同这次请求产生的调用记录一起保存，回放时重新记账，任务预算的判断与录制时一致
+            with UsageTracker().activate() as tracker:
+                text = await self._request(message, reasoning_effort, on_content)
+            return {"text": text, "calls": tracker.calls}
+
+        # 录制/回放模式下以渲染后的提示词作为键
+        recorded = await self.cassette.wrap("llm", {"prompt": message}, request)
+        if isinstance(recorded, str):
+            # 旧版本录制的记录只有文本
+            return recorded
+        if self.cassette.replaying:
+            for call in recorded["calls"]:
+                record_call(call)
+        return recorded["text"]
+
+    async def _request(self, message: str, reasoning_effort="low", on_content=None):
+        estimated_tokens = estimate_tokens(message)
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._race(message, reasoning_effort, on_content, estimated_tokens)
+            except LLMRequestError as error:
+                if not error.retryable or attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, error.retry_after)
+                metrics.inc("deepsearch_llm_retries_total")
+                logger.warning("LLM 请求失败（%s），%.1f 秒后重试（第 %d 次）", error, delay, attempt + 1)
+                await asyncio.sleep(delay)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.base_url, headers=headers, json=payload
+    def _next_endpoint(self, tried: List[Endpoint]) -> Endpoint | None:
+        """按配置顺序返回下一个未尝试且未熔断的端点"""
+        for endpoint in self.endpoints:
+            if endpoint not in tried and endpoint.breaker.allow():
+                return endpoint
+        return None
+
+    async def _race(self, message: str, reasoning_effort, on_content, estimated_tokens: int):
+        """
+        一轮请求：先请求第一个可用端点，失败时依次切换到下一个端点，必要时发出对冲请求
+
+        流式请求以收到第一段内容的一方为胜者，其余请求立即取消，只有胜者的内容会回调 on_content；
+        胜者在输出回答内容之后中断时不再切换端点，以免同样的内容被回调两次。
+        """
+        stream = on_content is not None
+        loop = asyncio.get_running_loop()
+        tried: List[Endpoint] = []
+        pending: Dict[asyncio.Future, Endpoint] = {}
+        progress = {"winner": None, "streamed": False}
+        hedged = False
+        last_error: LLMRequestError | None = None
+
+        def claim(endpoint: Endpoint) -> bool:
+            if progress["winner"] is None:
+                progress["winner"] = endpoint
+                for task, other in pending.items():
+                    if other is not endpoint:
+                        task.cancel()
+            return progress["winner"] is endpoint
+
+        def forward(text: str) -> None:
+            progress["streamed"] = True
+            on_content(text)
+
+        def start() -> bool:
+            endpoint = self._next_endpoint(tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            task = asyncio.ensure_future(
+                self._attempt(
+                    endpoint,
+                    message,
+                    reasoning_effort,
+                    forward if stream else None,
+                    estimated_tokens,
+                    lambda: claim(endpoint),
+                )
+            )
+            pending[task] = endpoint
+            return True
+
+        if not start():
+            wait = min(endpoint.breaker.remaining() for endpoint in self.endpoints)
+            raise LLMRequestError("所有 LLM 端点都处于熔断状态", retry_after=wait)
+
+        hedge_at = None
+        if self.hedge and len(self.endpoints) > 1:
+            delay = tried[0].hedge_delay(stream)
+            if delay is not None:
+                hedge_at = loop.time() + delay
+
+        try:
+            while pending:
+                timeout = None
+                if hedge_at is not None and progress["winner"] is None and len(pending) == 1:
+                    timeout = max(0.0, hedge_at - loop.time())
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # 超过高分位延迟仍未返回，向下一个端点发出相同的请求
+                    hedge_at = None
+                    hedged = start()
+                    if hedged:
+                        logger.info("LLM 请求超过 %s 的高分位延迟，对冲到 %s", tried[0].name, tried[-1].name)
+                    continue
+
+                for task in done:
+                    endpoint = pending.pop(task)
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        if hedged:
+                            metrics.inc(
+                                "deepsearch_llm_hedges_total",
+                                winner="primary" if endpoint is tried[0] else "hedge",
+                            )
+                        return task.result()
+                    if not isinstance(error, LLMRequestError):
+                        raise error
+                    if progress["winner"] is endpoint:
+                        if progress["streamed"]:
+                            raise LLMRequestError(f"流式输出中断: {error}", retryable=False) from error
+                        progress["winner"] = None
+                    logger.warning("LLM 端点 %s 请求失败: %s", endpoint.name, error)
+                    last_error = error
+
+                if not pending and start():
+                    metrics.inc("deepsearch_llm_failovers_total", endpoint=tried[-1].name)
+                    logger.info("切换到 LLM 端点 %s", tried[-1].name)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise last_error or LLMRequestError("LLM 请求被取消")
+
+    async def _attempt(
+        self,
+        endpoint: Endpoint,
+        message: str,
+        reasoning_effort,
+        on_content,
+        estimated_tokens: int,
+        claim: Callable[[], bool],
+    ):
+        """向一个端点发出一次请求，并把结果记入该端点的熔断器和延迟统计"""
+        stream = on_content is not None
+        payload = self._build_payload(
+            [{"role": "user", "content": message}], reasoning_effort, endpoint.model_name
+        )
+        if stream:
+            payload["stream"] = True
+
+        await self.limiter.acquire(estimated_tokens)
+        # 耗时和首 token 延迟从请求发出时算起，不含限速等待
+        start = time.perf_counter()
+        try:
+            async with self.http.session().post(
+                endpoint.base_url,
+                headers=self._get_headers(),
+                json=payload,
+                timeout=self.http.timeout("llm"),
             ) as response:
+                metrics.inc("deepsearch_llm_requests_total", status=response.status, endpoint=endpoint.name)
                 if response.status != 200:
                     error_text = await response.text()
-                    raise Exception(
-                        f"API request failed with status {response.status}: {error_text}"
+                    raise LLMRequestError(
+                        f"API request failed with status {response.status}: {error_text}",
+                        status=response.status,
+                        retryable=is_retryable_status(response.status),
+                        retry_after=parse_retry_after(response.headers.get("Retry-After")),
                     )
-                response = await response.json()
-                print(response)
-                think_content = response["choices"][0]["message"]["reasoning"]
-                content = (
-                    think_content + "\n" + response["choices"][0]["message"]["content"]
+                if stream:
+                    think_content, content, usage, first_token_at = await self._read_stream(
+                        response, on_content, claim
+                    )
+                else:
+                    # 非流式时以收到响应头的时间近似首 token 延迟
+                    first_token_at = time.perf_counter()
+                    response = await response.json()
+                    logger.debug("LLM 响应: %s", log_payload(response))
+                    if "error" in response:
+                        raise LLMRequestError(f"API request failed: {response['error']}")
+                    usage = response.get("usage") or {}
+                    think_content = response["choices"][0]["message"].get("reasoning") or ""
+                    content = response["choices"][0]["message"]["content"] or ""
+                    claim()
+        except asyncio.CancelledError:
+            # 被取消的请求（对冲中落败的一方、调用方取消）：归还预估的 token 配额，
+            # 但请求已经发出，按估算的提示词 token 数记一次调用，以免少算用量和费用
+            endpoint.breaker.release()
+            self.limiter.settle(estimated_tokens, 0)
+            elapsed = time.perf_counter() - start
+            record_call(
+                make_call(
+                    endpoint.model_name,
+                    {},
+                    seconds=elapsed,
+                    ttft=elapsed,
+                    estimated_prompt=estimated_tokens,
                 )
-                return content
\ No newline at end of file
+            )
+            raise
+        except LLMRequestError as error:
+            if error.retry_after is not None:
+                # 429 Retry-After：该端点断开到指定时间之后，共享的限速器也一并暂停，
+                # 避免其他 Agent 的请求继续撞上同一个配额
+                endpoint.breaker.open_for(error.retry_after)
+                self.limiter.block_for(error.retry_after)
+            elif error.retryable:
+                endpoint.breaker.record_failure()
+            else:
+                endpoint.breaker.release()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, IndexError, ValueError) as error:
+            endpoint.breaker.record_failure()
+            raise LLMRequestError(f"{type(error).__name__}: {error}") from error
+        except Exception:
+            # 其他意外错误也要结束熔断器的试探状态，否则半开的端点会一直被占用
+            endpoint.breaker.record_failure()
+            raise
+
+        end = time.perf_counter()
+        endpoint.breaker.record_success()
+        endpoint.observe(stream, (first_token_at or end) - start if stream else end - start)
+        if usage.get("total_tokens"):
+            self.limiter.settle(estimated_tokens, usage["total_tokens"])
+        record_call(
+            make_call(
+                endpoint.model_name,
+                usage,
+                seconds=end - start,
+                ttft=(first_token_at or end) - start,
+                estimated_prompt=estimated_tokens,
+                estimated_completion=estimate_tokens(think_content + content),
+            )
+        )
+        return think_content + "\n" + content
+
+    @staticmethod
+    async def _read_stream(
+        response,
+        on_content: Callable[[str], None],
+        on_first_token: Callable[[], bool] | None = None,
+    ):
+        """
+        读取 SSE 流，返回 (推理内容, 回答内容, usage, 收到第一段内容的时间)
+
+        收到第一段内容时调用 on_first_token，返回 False 表示另一个对冲请求已经胜出，停止读取。
+        """
+        first_token_at = None
+        reasoning_parts = []
+        content_parts = []
+        usage = {}
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").strip()
+            # 跳过空行和 ": OPENROUTER PROCESSING" 之类的注释行
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise LLMRequestError(f"API stream failed: {chunk['error']}")
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices", []):
+                delta = choice.get("delta") or {}
+                if first_token_at is None and (delta.get("reasoning") or delta.get("content")):
+                    first_token_at = time.perf_counter()
+                    if on_first_token is not None and not on_first_token():
+                        raise asyncio.CancelledError()
+                if delta.get("reasoning"):
+                    reasoning_parts.append(delta["reasoning"])
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+                    on_content(delta["content"])
+        return "".join(reasoning_parts), "".join(content_parts), usage, first_token_at
\ No newline at end of file
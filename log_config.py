@@ -0,0 +1,44 @@
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+# 完整的提示词、模型输出和工具结果每次可达数百 KB，默认只记录长度
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "0").lower() in ("1", "true", "yes")
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def setup_logging(level: str | None = None) -> None:
+    """
+    配置根日志（只应在入口脚本中调用一次）
+
+    LOG_LEVEL 默认 INFO；提示词、模型输出等载荷在 DEBUG 级别记录，
+    且只有 LOG_PAYLOADS=1 时才记录完整内容。日志写到标准错误，不与命令行的结果输出混在一起。
+    """
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT, stream=sys.stderr)
+
+
+class _Payload:
+    """延迟格式化的载荷：只有日志真正输出时才调用 str()，INFO 级别下不产生任何开销"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: object) -> None:
+        self.value = value
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if LOG_PAYLOADS:
+            return text
+        return f"<{len(text)} 字符，设置 LOG_PAYLOADS=1 查看完整内容>"
+
+
+def log_payload(value: object) -> object:
+    """用于日志参数：LOG_PAYLOADS=1 时输出完整内容，否则只输出长度说明"""
+    return _Payload(value)
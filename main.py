@@ -1,20 +1,38 @@
 import asyncio
+import logging
+import os
 import random
 import re
 import string
 import sys
-import traceback
+import time
 from datetime import datetime
 from typing import (
     Any,
     Dict,
     List,
     Optional,
+    Tuple,
 )
 
 from break_prompt import BreakPrompt
+from cassette import CassetteMiss, get_cassette
+from checkpoint import Checkpoint, CheckpointStore, get_checkpoint_store, make_task_id
+from compaction import WorkspaceCompactor
+from http_client import http_client
+from json_stream import ToolCallStreamParser
+from log_config import setup_logging
+from metrics import metrics, start_metrics_server, tool_metrics
+from prefetch import Prefetcher
 from prompt import Prompt
-from tools import ScrapTool, SearchTool, extract_largest_json
+from rate_limiter import backoff_delay
+from search_cache import normalize_query
+from token_budget import PromptBudget
+from tools import PageFetchError, ScrapTool, SearchTool, extract_largest_json
+from urls import canonicalize_url, find_urls
+from usage import UsageTracker
+
+logger = logging.getLogger(__name__)
 
 
 AGENT_PROMPT_TEMPLATE = """
@@ -138,9 +156,26 @@ AGENT_PROMPT_TEMPLATE = """
 不要依赖你的内部知识（可能有偏见），目标是使用工具发现信息！
 """
 
+# 工具输出以这些前缀开头时表示调用没有得到结果（不会被记入去重账本）
+TOOL_FAILED = "Tool execution failed"
+TOOL_TIMED_OUT = "工具调用超时"
+
+
+def tool_status(output: str) -> str:
+    """根据工具输出判断调用结果：ok、failed 或 timeout"""
+    output = str(output)
+    if output.startswith(TOOL_TIMED_OUT):
+        return "timeout"
+    if output.startswith(TOOL_FAILED):
+        return "failed"
+    return "ok"
+
+
 class Workspace:
-    def __init__(self):
+    def __init__(self, seed: Optional[str] = None):
         self.state = {"status": "进行中", "blocks": {}, "answer": None, "important_links": []}
+        # 指定 seed 时块 ID 可复现（录制/回放需要逐字节相同的提示词）
+        self._random = random.Random(seed) if seed is not None else random
 
     def to_string(self):
         """
@@ -172,8 +207,8 @@ class Workspace:
         """
         while True:
             # Generate random ID in abc-123 format
-            letters = "".join(random.choices(string.ascii_lowercase, k=3))
-            digits = "".join(random.choices(string.digits, k=3))
+            letters = "".join(self._random.choices(string.ascii_lowercase, k=3))
+            digits = "".join(self._random.choices(string.digits, k=3))
             new_id = f"{letters}-{digits}"
 
             # Return ID if it's unique
@@ -216,6 +251,21 @@ class Workspace:
         if answer is not None:
             self.state["answer"] = answer
 
+    def replace_blocks(self, block_ids: List[str], contents: List[str]):
+        """用 contents 替换 block_ids 对应的块（压缩工作区时使用），新块排在其余块之前"""
+        blocks = self.state["blocks"]
+        for block_id in block_ids:
+            blocks.pop(block_id, None)
+        new_ids = []
+        for content in contents:
+            new_id = self._generate_unique_block_id()
+            blocks[new_id] = content
+            new_ids.append(new_id)
+        self.state["blocks"] = {
+            **{block_id: blocks[block_id] for block_id in new_ids},
+            **{block_id: content for block_id, content in blocks.items() if block_id not in new_ids},
+        }
+
     def add_important_links(self, links: List[Dict]):
         self.state["important_links"].extend(links)
 
@@ -223,124 +273,609 @@ class Workspace:
         return self.state["status"] != "进行中"
     
 class Agent:
-    # Tools the agent can call
-    tools = {"search": SearchTool(), "scrape": ScrapTool()}
+    # Tools the agent can call（search 的增强模式与 scrape 共用同一套提取流程和缓存）
+    _scrape_tool = ScrapTool()
+    tools = {"search": SearchTool(scraper=_scrape_tool), "scrape": _scrape_tool}
 
     def __init__(
         self,
         task: str,
         prompt: Prompt,
         current_date: str = datetime.now().strftime("%Y-%m-%d"),
+        stream: bool | None = None,
+        budget: PromptBudget | None = None,
+        round_deadline: float | None = None,
+        task_id: str | None = None,
+        checkpoints: CheckpointStore | None = None,
+        compactor: WorkspaceCompactor | None = None,
+        prefetcher: Prefetcher | None = None,
+        max_task_tokens: int | None = None,
+        max_task_seconds: float | None = None,
     ):
         self.task = task
+        # 每轮结束后按 task_id 保存检查点，进程重启后可以用 Agent.resume() 继续
+        self.task_id = task_id or make_task_id(task)
+        self.checkpoints = checkpoints if checkpoints is not None else get_checkpoint_store()
         self.prompt = prompt
+        # 每轮工具调用的总截止时间（秒），以及各工具单次调用的超时
+        self.round_deadline = (
+            round_deadline if round_deadline is not None else float(os.getenv("ROUND_DEADLINE", "60"))
+        )
+        self.tool_timeouts = {
+            "search": float(os.getenv("TOOL_TIMEOUT_SEARCH", "20")),
+            "scrape": float(os.getenv("TOOL_TIMEOUT_SCRAPE", "30")),
+        }
+        # 发送前把工作区和工具结果裁剪到 token 预算以内（PROMPT_TOKEN_BUDGET）
+        self.budget = budget or PromptBudget()
+        # 记忆块超过 WORKSPACE_MAX_TOKENS 时在后台合并整理；(压缩任务, 开始时的记忆块)
+        self.compactor = compactor or WorkspaceCompactor()
+        self._compaction: Optional[Tuple[asyncio.Future, Dict[str, str]]] = None
+        # 流式模式下，工具调用在模型输出其余字段的同时就开始执行
+        self.stream = (
+            stream if stream is not None else os.getenv("LLM_STREAM", "0").lower() in ("1", "true", "yes")
+        )
+        self.cassette = get_cassette()
+        # 后台预取模型记下的 URL（PREFETCH_BUDGET）；回放时所有抓取结果都来自录制文件，不预取
+        self.prefetcher = prefetcher or Prefetcher(
+            self.tools["scrape"], budget=0 if self.cassette.replaying else None
+        )
         self.current_date = current_date
         self.tool_records = None
+        # 本任务已发起的工具调用：(工具, 规范化输入) -> {"task": 执行任务, "round": 首次调用的轮次}
+        self.ledger: Dict[Tuple[str, str], Dict[str, Any]] = {}
         self.workspace = Workspace()
+        if self.cassette.active:
+            # 录制时保存日期并固定块 ID 的随机种子，回放时才能渲染出相同的提示词
+            self.current_date = self.cassette.meta(f"current_date:{task}", current_date)
+            self.workspace = Workspace(seed=task)
         self.round = 0
+        # 每轮的耗时（秒）和模型用量：
+        # {"round": 轮次, "llm": 模型调用, "tools": 等待工具结果, "usage": 本轮的 token / 费用 / 首 token 延迟}
+        self.timings: List[Dict[str, Any]] = []
+        # 本任务所有模型调用的记录（包括后台压缩和最后的总结），self.usage.totals() 为任务汇总
+        self.usage = UsageTracker()
+        # 任务的 token 和时间预算（0 表示不限制）：超出后不再开始新的一轮，由调用方生成总结
+        self.max_task_tokens = (
+            max_task_tokens if max_task_tokens is not None else int(os.getenv("TASK_MAX_TOKENS", "0"))
+        )
+        self.max_task_seconds = (
+            max_task_seconds
+            if max_task_seconds is not None
+            else float(os.getenv("TASK_MAX_SECONDS", "0"))
+        )
+        self.stop_reason: Optional[str] = None
+        # 连续多少轮没有得到可用的模型输出（无法解析、字段格式错误等）后停止任务，0 表示不限制
+        self.max_round_errors = int(os.getenv("ROUND_MAX_ERRORS", "3"))
+        self.round_errors = 0
+        # 之前各次 run() 累计的运行时间，以及当前这次 run() 的开始时间
+        self.elapsed = 0.0
+        self._run_started: Optional[float] = None
+
+    def elapsed_seconds(self) -> float:
+        if self._run_started is None:
+            return self.elapsed
+        return self.elapsed + time.perf_counter() - self._run_started
+
+    def budget_exceeded(self) -> Optional[str]:
+        """超出任务预算时返回原因"""
+        if self.max_task_tokens:
+            used = self.usage.totals()["total_tokens"]
+            if used >= self.max_task_tokens:
+                return f"已使用 {used} tokens，达到任务预算 {self.max_task_tokens}"
+        if self.max_task_seconds:
+            elapsed = self.elapsed_seconds()
+            if elapsed >= self.max_task_seconds:
+                return f"已运行 {elapsed:.0f} 秒，达到任务时间预算 {self.max_task_seconds:g} 秒"
+        return None
+
+    async def summarize(self) -> str:
+        """未完成（轮数用完或超出预算）时用 BreakPrompt 总结工作区，用量计入本任务"""
+        start = time.perf_counter()
+        calls = len(self.usage.calls)
+        with self.usage.activate():
+            answer = await BreakPrompt().run(self.workspace.to_string())
+        self.timings.append(
+            {
+                "round": "summary",
+                "llm": time.perf_counter() - start,
+                "tools": 0.0,
+                "usage": self.usage.totals(calls),
+            }
+        )
+        return answer
+
+    def checkpoint(self) -> Checkpoint:
+        return {
+            "task_id": self.task_id,
+            "task": self.task,
+            "current_date": self.current_date,
+            "round": self.round,
+            "state": self.workspace.state,
+            "tool_records": self.tool_records,
+            "timings": self.timings,
+            "llm_calls": self.usage.calls,
+            "elapsed": self.elapsed_seconds(),
+            "saved_at": time.time(),
+        }
+
+    async def save_checkpoint(self) -> None:
+        if self.checkpoints is None:
+            return
+        try:
+            with metrics.span("checkpoint"):
+                # 在事件循环中序列化（此时状态不会被修改），线程中只做写入
+                checkpoint = self.checkpoint()
+                data = self.checkpoints.encode(checkpoint)
+                await asyncio.to_thread(self.checkpoints.save, checkpoint, data)
+        except Exception:
+            # 检查点只是为了加速恢复，写入失败不影响任务本身
+            logger.exception("保存检查点失败: %s", self.task_id)
+
+    async def finish(self) -> None:
+        """
+        任务已完成或已总结、结果已交给调用方后调用：停止后台工作并删除检查点，
+        之后再提交相同的任务会重新开始，而不是恢复到已经用完轮数的状态
+        """
+        self._cancel_background()
+        if self.checkpoints is None:
+            return
+        try:
+            await asyncio.to_thread(self.checkpoints.delete, self.task_id)
+        except Exception:
+            logger.exception("删除检查点失败: %s", self.task_id)
+
+    @classmethod
+    def resume(
+        cls,
+        task_id: str,
+        prompt: Prompt,
+        checkpoints: CheckpointStore | None = None,
+        **kwargs: Any,
+    ) -> Optional["Agent"]:
+        """
+        从 task_id 最新的检查点恢复 Agent（没有检查点时返回 None）
+
+        恢复工作区、上一轮的工具结果、轮次、任务和日期，run() 从下一轮继续。
+        检查点可能已经是完成状态，调用方应先检查 workspace.is_done()。
+        """
+        store = checkpoints if checkpoints is not None else get_checkpoint_store()
+        if store is None:
+            return None
+        saved = store.load(task_id)
+        if saved is None:
+            return None
+        agent = cls(
+            task=saved["task"],
+            prompt=prompt,
+            current_date=saved["current_date"],
+            task_id=task_id,
+            checkpoints=store,
+            **kwargs,
+        )
+        agent.workspace.state = saved["state"]
+        agent.tool_records = saved["tool_records"]
+        agent.round = saved["round"]
+        agent.timings = saved["timings"]
+        agent.usage = UsageTracker(saved.get("llm_calls"))
+        agent.elapsed = saved.get("elapsed", 0.0)
+        logger.info("从检查点恢复任务 %s：已完成 %d 轮", task_id, agent.round)
+        return agent
 
     async def run_tool(
         self, tool_id: str, tool_input: str, context: str | None = None
     ) -> str:
+        start = time.perf_counter()
+        status = "failed"
+        timeout = self.tool_timeouts.get(tool_id)
         try:
             assert tool_id in ["search", "scrape"], f"Illegal tool: {tool_id}"
             tool = self.tools[tool_id]
-            result = await tool(tool_input, context)
+
+            async def call() -> str:
+                try:
+                    return await tool(tool_input, context)
+                except PageFetchError as e:
+                    logger.warning("Tool %s failed: %s", tool_id, e)
+                    return f"{TOOL_FAILED}: {e}"
+                except Exception as e:
+                    logger.exception("Failed to run tool %s: %s", tool_id, tool_input)
+                    return f"{TOOL_FAILED}: {e}"
+
+            async def invoke() -> str:
+                # 失败和超时也转换成输出再录制，回放时得到同样的结果
+                try:
+                    return await asyncio.wait_for(call(), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning("Tool %s timed out after %ss: %s", tool_id, timeout, tool_input)
+                    return f"{TOOL_TIMED_OUT}：{timeout:g} 秒内未返回，已取消"
+
+            result = await self.cassette.wrap(tool_id, self._tool_payload(tool_input, context), invoke)
+            status = tool_status(result)
             return result
+        except CassetteMiss:
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
         except Exception as e:
-            print(f"Failed to run tool {e}")
-            print(traceback.format_exc())
-            return f"Tool execution failed: {e}"
-
-    async def run(self, loop=True, max_rounds: int | None = None) -> Dict[str, Any]:
-        while True:
+            logger.exception("Failed to run tool %s: %s", tool_id, tool_input)
+            return f"{TOOL_FAILED}: {e}"
+        finally:
+            if tool_id in self.tools:
+                tool_metrics.observe(tool_id, time.perf_counter() - start, status)
+
+    @staticmethod
+    def _tool_payload(tool_input: Any, context: str | None) -> Dict[str, Any]:
+        """工具调用在 cassette 中的键"""
+        return {"input": tool_input, "context": context}
+
+    @staticmethod
+    def _ledger_key(tool_id: str, tool_input: Any) -> Tuple[str, str]:
+        """同一页面的不同 URL 写法、只差大小写和空白的搜索词视为相同的调用"""
+        tool_input = str(tool_input)
+        if tool_id == "scrape":
             try:
-                # Rate limiting - 1 round per 20 seconds
-                await asyncio.sleep(10)
-
-                response = await self.prompt.run(
-                    {
-                        "current_date": self.current_date,
-                        "task": self.task,
-                        "workspace": self.workspace.to_string(),
-                        "tool_records": self.tool_records,
-                    }
+                return tool_id, canonicalize_url(tool_input)
+            except ValueError:
+                return tool_id, tool_input.strip()
+        return tool_id, normalize_query(tool_input)
+
+    async def call_tool(self, tool_id: str, tool_input: str) -> str:
+        """
+        带去重的工具调用
+
+        相同的调用在整个任务中只执行一次：并发的相同调用共享同一次执行，
+        之后轮次的重复调用直接返回之前的结果。失败或超时的调用不会被记住，可以重试。
+        """
+        key = self._ledger_key(tool_id, tool_input)
+        entry = self.ledger.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self.run_tool(tool_id, tool_input, self.task))
+            entry = {"task": task, "round": self.round, "input": tool_input}
+            self.ledger[key] = entry
+            if tool_id == "scrape":
+                self.prefetcher.mark_used(key[1])
+            task.add_done_callback(lambda t: self._on_tool_done(key, t))
+        else:
+            metrics.inc(
+                "deepsearch_tool_dedup_total",
+                tool=tool_id,
+                kind="shared" if not entry["task"].done() else "memoized",
+            )
+        # 调用方被取消（例如流式阶段提前启动的调用最终被丢弃）不影响共享的执行
+        output = await asyncio.shield(entry["task"])
+        if entry["round"] < self.round:
+            return f"（第 {entry['round'] + 1} 轮已执行过相同的调用，以下是当时的结果）\n{output}"
+        return output
+
+    def _on_tool_done(self, key: Tuple[str, str], task: asyncio.Future) -> None:
+        failed = (
+            task.cancelled()
+            or task.exception() is not None
+            or tool_status(task.result()) != "ok"
+        )
+        if failed and self.ledger.get(key, {}).get("task") is task:
+            del self.ledger[key]
+
+    async def _gather_with_deadline(
+        self, tool_calls: List[Dict], tasks: List[asyncio.Future]
+    ) -> List[str]:
+        """
+        等待本轮的工具调用，最多等待 round_deadline 秒
+
+        截止时仍未完成的调用会被取消（包括共享的执行任务），
+        其输出标记为超时，本轮继续使用已经返回的结果。
+        录制模式下超时的输出也会录制下来，回放时这些调用直接返回同样的超时结果。
+        """
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=self.round_deadline)
+        outputs = []
+        for call, task in zip(tool_calls, tasks):
+            if task in done:
+                outputs.append(task.result())
+                continue
+            task.cancel()
+            output = f"{TOOL_TIMED_OUT}：本轮截止时间 {self.round_deadline:g} 秒内未返回，已取消"
+            entry = self.ledger.get(self._ledger_key(call["tool"], call["input"]))
+            if entry is not None and not entry["task"].done():
+                entry["task"].cancel()
+                self.cassette.record(
+                    call["tool"], self._tool_payload(entry["input"], self.task), output
                 )
+            outputs.append(output)
+        if pending:
+            logger.warning("本轮有 %d 个工具调用超过截止时间，已取消", len(pending))
+        return outputs
+
+    def _start_compaction(self) -> None:
+        """
+        记忆块超出预算时启动后台压缩
 
-                response = re.sub(
-                    r"(?:<think>)?.*?</think>", "", response, flags=re.DOTALL
+        压缩与本轮的工具调用并发进行，不等待它完成；
+        结果在之后某一轮开始时由 _apply_compaction() 合并进工作区
+        （录制/回放时固定在下一轮开始时合并，见 _apply_compaction()）。
+        """
+        blocks = self.workspace.state["blocks"]
+        if self._compaction is not None or not self.compactor.needed(blocks):
+            return
+        snapshot = dict(blocks)
+        self._compaction = (asyncio.ensure_future(self.compactor.compact(snapshot)), snapshot)
+
+    async def _apply_compaction(self) -> None:
+        if self._compaction is None:
+            return
+        if self.cassette.active:
+            # 合并时机取决于压缩何时完成，录制和回放会渲染出不同的提示词；
+            # 录制/回放时在下一轮开始时等待压缩完成，保证提示词可复现
+            await asyncio.wait([self._compaction[0]])
+        if not self._compaction[0].done():
+            return
+        task, snapshot = self._compaction
+        self._compaction = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            metrics.inc("deepsearch_compactions_total", result="failed")
+            return
+        contents = task.result()
+        if contents is None:
+            return
+        blocks = self.workspace.state["blocks"]
+        if any(blocks.get(block_id) != content for block_id, content in snapshot.items()):
+            # 压缩期间模型删除了其中的块，合并结果已经过时；下一轮会按需重新压缩
+            metrics.inc("deepsearch_compactions_total", result="stale")
+            return
+        self.workspace.replace_blocks(list(snapshot), contents)
+        metrics.inc("deepsearch_compactions_total", result="applied")
+
+    def _cancel_compaction(self) -> None:
+        if self._compaction is not None:
+            self._compaction[0].cancel()
+            self._compaction = None
+
+    def _start_prefetch(self, texts: List[str]) -> None:
+        """预取本轮新记下的 URL，跳过本任务已经抓取过或正在抓取的"""
+        if self.workspace.is_done():
+            return
+        urls = [
+            url
+            for text in texts
+            for url in find_urls(text)
+            if self._ledger_key("scrape", url) not in self.ledger
+        ]
+        self.prefetcher.schedule(urls)
+
+    def _cancel_background(self) -> None:
+        self._cancel_compaction()
+        self.prefetcher.cancel()
+
+    async def _round_failed(self) -> bool:
+        """
+        本轮没有得到可用的模型输出：退避后重试同一轮
+
+        失败的轮次不计入 self.round，连续失败 max_round_errors 次时设置 stop_reason 并返回 True
+        """
+        self.round_errors += 1
+        metrics.inc("deepsearch_round_errors_total")
+        if self.max_round_errors and self.round_errors >= self.max_round_errors:
+            self.stop_reason = f"连续 {self.round_errors} 轮没有得到可用的模型输出"
+            logger.warning("任务 %s 停止：%s", self.task_id, self.stop_reason)
+            self._cancel_background()
+            return True
+        await asyncio.sleep(backoff_delay(self.round_errors - 1))
+        return False
+
+    def _dispatch_tool_calls(
+        self,
+        tool_calls: List[Dict],
+        dispatched: List[tuple],
+    ) -> List[asyncio.Future]:
+        """
+        为最终解析出的 tool_calls 准备执行任务
+
+        流式阶段已按相同顺序提前启动的调用直接复用其任务，其余的新建任务；
+        提前启动但最终不在 tool_calls 中的任务会被取消。
+        """
+        tasks = []
+        for i, call in enumerate(tool_calls):
+            if i < len(dispatched) and dispatched[i][0] == call:
+                tasks.append(dispatched[i][1])
+            else:
+                tasks.append(asyncio.ensure_future(self.call_tool(call["tool"], call["input"])))
+        for _, task in dispatched:
+            if task not in tasks:
+                task.cancel()
+        return tasks
+
+    async def run(self, loop=True, max_rounds: int | None = None) -> None:
+        """运行一轮（loop=False）或直到完成、用完 max_rounds 轮或超出任务预算"""
+        self._run_started = time.perf_counter()
+        try:
+            # 本次运行中的所有模型调用（包括其中启动的后台压缩）都记入 self.usage
+            with self.usage.activate():
+                await self._run(loop, max_rounds)
+        except asyncio.CancelledError:
+            # 调用方取消了运行（批处理的任务超时、Web 客户端断开等）：后台压缩、预取和
+            # 仍在进行的工具调用的结果都不会再被使用，一并取消，避免继续消耗 token 和带宽
+            self._cancel_background()
+            for entry in self.ledger.values():
+                entry["task"].cancel()
+            raise
+        finally:
+            self.elapsed = self.elapsed_seconds()
+            self._run_started = None
+
+    async def _run(self, loop: bool, max_rounds: int | None) -> None:
+        while True:
+            # 先检查轮数：从用完轮数的检查点恢复时不再多调用一次模型
+            if max_rounds and self.round >= max_rounds:
+                self._cancel_background()
+                break
+
+            self.stop_reason = self.budget_exceeded()
+            if self.stop_reason:
+                logger.info("任务 %s 提前停止：%s", self.task_id, self.stop_reason)
+                self._cancel_background()
+                break
+
+            # 流式输出中提前启动的 (call, task)
+            dispatched = []
+
+            def dispatch(call: Dict) -> None:
+                dispatched.append(
+                    (call, asyncio.ensure_future(self.call_tool(call["tool"], call["input"])))
                 )
-                response_json = extract_largest_json(response)
+
+            generation_args = (
+                {"on_content": ToolCallStreamParser(dispatch).feed} if self.stream else {}
+            )
+
+            timing = {"round": self.round + 1, "llm": 0.0, "tools": 0.0}
+            calls = len(self.usage.calls)
+            try:
+                await self._apply_compaction()
+                llm_start = time.perf_counter()
+                # 限速由 OpenRouterModel 共享的 RateLimiter 负责，配额充足时不再空等
+                with metrics.span("budget"):
+                    prompt_variables = self.budget.apply(
+                        self.prompt,
+                        {
+                            "current_date": self.current_date,
+                            "task": self.task,
+                            "workspace": self.workspace.to_string(),
+                            "tool_records": self.tool_records,
+                        },
+                        task=self.task,
+                        label=f"第 {self.round + 1} 轮",
+                    )
+                response = await self.prompt.run(prompt_variables, generation_args)
+                timing["llm"] = time.perf_counter() - llm_start
+
+                with metrics.span("parse"):
+                    response = re.sub(
+                        r"(?:<think>)?.*?</think>", "", response, flags=re.DOTALL
+                    )
+                    response_json = extract_largest_json(response)
                 if not response_json:
-                    print(f"无法从响应中提取JSON: {response[:200]}...")
-                    await asyncio.sleep(10)
+                    logger.warning("无法从响应中提取JSON: %s...", response[:200])
+                    self._dispatch_tool_calls([], dispatched)
+                    if await self._round_failed():
+                        break
                     continue
 
                 # 确保memory_updates字段存在
                 if "memory_updates" not in response_json:
-                    print("响应中缺少memory_updates字段")
+                    logger.warning("响应中缺少memory_updates字段")
                     response_json["memory_updates"] = []
                 
                 # 确保tool_calls字段存在
                 if "tool_calls" not in response_json:
-                    print("响应中缺少tool_calls字段")
+                    logger.warning("响应中缺少tool_calls字段")
                     response_json["tool_calls"] = []
 
+                known_blocks = set(self.workspace.state["blocks"])
                 self.workspace.update_blocks(
                     response_json.get("status_update", "进行中"),
                     response_json.get("memory_updates", []),
                     response_json.get("answer", None),
                 )
 
-                self.workspace.add_important_links(response_json.get("important_links", []))
+                important_links = response_json.get("important_links", [])
+                self.workspace.add_important_links(important_links)
 
                 tool_calls = response_json["tool_calls"]
 
-                tasks = [
-                    self.run_tool(call["tool"], call["input"], self.task)
-                    for call in tool_calls
-                ]
-
-                tool_outputs = await asyncio.gather(*tasks)
+                tasks = self._dispatch_tool_calls(tool_calls, dispatched)
+                self._start_compaction()
+                # 新记忆块和重要链接中的 URL 多半是之后要抓取的，趁下一次模型调用时提前抓取
+                self._start_prefetch(
+                    [
+                        content
+                        for block_id, content in self.workspace.state["blocks"].items()
+                        if block_id not in known_blocks
+                    ]
+                    + [str(link.get("url", "")) for link in important_links if isinstance(link, dict)]
+                )
 
-                tool_records = [
-                    {**call, "output": output}
-                    for call, output in zip(tool_calls, tool_outputs)
-                ]
+                with metrics.span("tools") as span:
+                    tool_outputs = await self._gather_with_deadline(tool_calls, tasks)
+                timing["tools"] = span.seconds
+
+                # 同一批中重复的调用只保留第一份结果，其余指向它
+                tool_records = []
+                first_source = {}
+                for i, (call, output) in enumerate(zip(tool_calls, tool_outputs), 1):
+                    key = self._ledger_key(call["tool"], call["input"])
+                    if key in first_source:
+                        output = f"（与来源 {first_source[key]} 是相同的调用，结果见来源 {first_source[key]}）"
+                    else:
+                        first_source[key] = i
+                    tool_records.append({**call, "output": output, "status": tool_status(output)})
 
                 # Will be appended to the prompt in the next round
                 self.tool_records = tool_records
 
+            except CassetteMiss:
+                # 回放缺失时重试只会得到同样的结果
+                self._dispatch_tool_calls([], dispatched)
+                raise
             except Exception as e:
-                print(f"Error in agent loop: {str(e)}")
-                print(traceback.format_exc())
-                await asyncio.sleep(10)
+                logger.exception("Error in agent loop: %s", e)
+                self._dispatch_tool_calls([], dispatched)
+                if await self._round_failed():
+                    break
                 continue
 
+            self.round_errors = 0
+            timing["usage"] = self.usage.totals(calls)
+            self.timings.append(timing)
+            metrics.inc("deepsearch_rounds_total")
             self.round += 1
-            if max_rounds and self.round > max_rounds:
+            await self.save_checkpoint()
+            if max_rounds and self.round >= max_rounds:
+                self._cancel_background()
                 break
 
-            if not loop:
+            if self.workspace.is_done():
+                self._cancel_background()
                 break
 
-            if self.workspace.is_done():
+            if not loop:
                 break
 
 prompt = Prompt(AGENT_PROMPT_TEMPLATE)
 
 async def main(task: str):
-    agent = Agent(task=task, prompt=prompt)
-    await agent.run(loop=True, max_rounds=8)
-    if agent.workspace.state['status'] != '已完成':
-        brokeprompt = BreakPrompt()
-        response = await brokeprompt.run(agent.workspace.to_string())
-        print(f"\n最终答案:\n{response}")
-        print(f"\n重要链接:\n{agent.workspace.state['important_links']}")
-    else:
-        print(f"\n最终答案:\n{agent.workspace.state['answer']}")
-        print(f"\n重要链接:\n{agent.workspace.state['important_links']}")
+    # 连接池在整个任务期间共享，结束时关闭
+    async with http_client.lifespan():
+        # 同一任务上次中途退出时从检查点继续
+        agent = Agent.resume(make_task_id(task), prompt)
+        if agent is None or agent.workspace.is_done():
+            agent = Agent(task=task, prompt=prompt)
+        await agent.run(loop=True, max_rounds=8)
+        if agent.workspace.state['status'] != '已完成':
+            if agent.stop_reason:
+                print(f"\n提前停止: {agent.stop_reason}")
+            response = await agent.summarize()
+            print(f"\n最终答案:\n{response}")
+            print(f"\n重要链接:\n{agent.workspace.state['important_links']}")
+        else:
+            print(f"\n最终答案:\n{agent.workspace.state['answer']}")
+            print(f"\n重要链接:\n{agent.workspace.state['important_links']}")
+        await agent.finish()
+        # 各工具的延迟分布，用于调整 TOOL_TIMEOUT_* 和 ROUND_DEADLINE
+        print(f"\n工具延迟:\n{tool_metrics.summary()}")
+        print(f"\n模型用量:\n{format_usage(agent.usage.totals())}")
+
+
 
+def format_usage(totals: Dict[str, float]) -> str:
+    return (
+        f"{totals['calls']} 次调用  提示 {totals['prompt_tokens']} / 输出 {totals['completion_tokens']} "
+        f"（推理 {totals['reasoning_tokens']}） tokens  费用 ${totals['cost']:.4f}  "
+        f"模型耗时 {totals['seconds']:.1f}s  首 token 平均 {totals['ttft_avg']:.2f}s / 最大 {totals['ttft_max']:.2f}s"
+    )
 
 
 demo_task = """
@@ -352,6 +887,9 @@ demo_task = """
 """
 
 if __name__ == "__main__":
+    setup_logging()
+    # 设置了 METRICS_PORT 时，任务运行期间可以从 /metrics 抓取指标
+    start_metrics_server()
     # if has args, then run main with args
     if len(sys.argv) > 1:
         asyncio.run(main(sys.argv[1]))
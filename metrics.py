@@ -0,0 +1,298 @@
+import bisect
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 默认的延迟分桶上界（秒），覆盖从缓存命中到慢速抓取的范围
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# Agent 各阶段的分桶：解析、渲染等在毫秒级，模型调用可达数分钟
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class LatencyHistogram:
+    """
+    固定分桶的延迟直方图
+
+    只保存每个桶的计数、总数和总和，内存占用与调用次数无关；
+    分位数按桶内线性插值估算，足以用来调整超时和截止时间。
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # 最后一个计数对应 +Inf 桶
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    # 落在 +Inf 桶中，只能报告最大的有限上界
+                    return lower
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """[(上界, 不超过该上界的累计次数), ...]，最后一项上界为 inf"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class ToolMetrics:
+    """按工具名统计执行延迟和结果状态（ok / failed / timeout / cancelled）"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.status: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, tool: str, seconds: float, status: str = "ok") -> None:
+        with self._lock:
+            histogram = self.latency.get(tool)
+            if histogram is None:
+                histogram = self.latency[tool] = LatencyHistogram(self.buckets)
+            histogram.observe(seconds)
+            self.status[(tool, status)] += 1
+
+    def summary(self) -> str:
+        """每个工具一行：次数、平均值、p50/p95/p99 和各状态计数"""
+        lines = []
+        with self._lock:
+            for tool, histogram in sorted(self.latency.items()):
+                quantiles = "  ".join(
+                    f"p{int(q * 100)}={histogram.quantile(q):.2f}s" for q in (0.5, 0.95, 0.99)
+                )
+                statuses = ", ".join(
+                    f"{status}={count}"
+                    for (name, status), count in sorted(self.status.items())
+                    if name == tool
+                )
+                lines.append(
+                    f"{tool}: {histogram.count} 次  平均 {histogram.sum / histogram.count:.2f}s  "
+                    f"{quantiles}  ({statuses})"
+                )
+        return "\n".join(lines)
+
+    def prometheus(self) -> List[str]:
+        """Prometheus 文本格式：deepsearch_tool_seconds 直方图和 deepsearch_tool_calls_total 计数"""
+        with self._lock:
+            lines = render_histograms(
+                "deepsearch_tool_seconds",
+                "工具单次调用的耗时（秒）",
+                {(("tool", tool),): histogram for tool, histogram in self.latency.items()},
+            )
+            lines += render_counters(
+                "deepsearch_tool_calls_total",
+                "按结果状态统计的工具调用次数",
+                {(("status", status), ("tool", tool)): count for (tool, status), count in self.status.items()},
+            )
+        return lines
+
+
+def render_counters(name: str, help_text: str, samples: Dict[Labels, float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    return lines
+
+
+def render_histograms(name: str, help_text: str, samples: Dict[Labels, LatencyHistogram]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(samples.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_bound(bound)),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return lines
+
+
+class Span:
+    """span() 产生的计时结果，退出上下文后 seconds 为该阶段的耗时"""
+
+    __slots__ = ("stage", "seconds")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.seconds = 0.0
+
+
+class MetricsRegistry:
+    """
+    进程级的计数器和阶段耗时直方图，以 Prometheus 文本格式导出
+
+    计数器和直方图在首次使用时自动创建；缓存等已有统计字典的组件可以通过
+    register_stats() 在导出时读取，不必在热路径上重复计数。
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, LatencyHistogram]] = {}
+        self.help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self.help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels: object) -> None:
+        key = _labels(labels)
+        with self._lock:
+            samples = self.counters.setdefault(name, {})
+            samples[key] = samples.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, buckets: Sequence[float] = STAGE_BUCKETS, **labels: object) -> None:
+        key = _labels(labels)
+        with self._lock:
+            samples = self.histograms.setdefault(name, {})
+            histogram = samples.get(key)
+            if histogram is None:
+                histogram = samples[key] = LatencyHistogram(buckets)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **labels: object) -> Iterator[Span]:
+        """
+        记录一个阶段的耗时（deepsearch_stage_seconds{stage=...}）
+
+        同步和异步代码中都可以使用：
+            with metrics.span("llm") as span:
+                response = await model(prompt)
+            print(span.seconds)
+        """
+        span = Span(stage)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - start
+            self.observe("deepsearch_stage_seconds", span.seconds, stage=stage, **labels)
+            logger.debug("阶段 %s 耗时 %.3fs", stage, span.seconds)
+
+    def register(self, collector: Callable[[], List[str]]) -> None:
+        """注册一个在导出时调用、返回 Prometheus 文本行的函数"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def register_stats(
+        self, name: str, help_text: str, stats: Callable[[], Dict[str, int]], label: str
+    ) -> None:
+        """把一个 {事件: 次数} 的统计字典导出为计数器，字典的键作为 label 的值"""
+        self.register(
+            lambda: render_counters(
+                name, help_text, {((label, key),): value for key, value in stats().items()}
+            )
+        )
+
+    def render(self) -> str:
+        with self._lock:
+            lines: List[str] = []
+            for name, samples in sorted(self.counters.items()):
+                lines += render_counters(name, self.help.get(name, name), samples)
+            for name, samples in sorted(self.histograms.items()):
+                lines += render_histograms(name, self.help.get(name, name), samples)
+            collectors = list(self._collectors)
+        for collector in collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+# 进程内所有 Agent 共享
+tool_metrics = ToolMetrics()
+metrics = MetricsRegistry()
+metrics.register(tool_metrics.prometheus)
+metrics.describe("deepsearch_stage_seconds", "Agent 各阶段的耗时（秒）")
+metrics.describe("deepsearch_llm_requests_total", "LLM 请求次数（按 HTTP 状态和端点）")
+metrics.describe("deepsearch_llm_retries_total", "LLM 请求在所有端点都失败后退避重试的次数")
+metrics.describe("deepsearch_llm_tokens_total", "LLM 消耗的 token 数（按类型）")
+metrics.describe("deepsearch_tool_dedup_total", "重复的工具调用复用已有执行的次数")
+metrics.describe("deepsearch_rounds_total", "Agent 完成的轮数")
+metrics.describe("deepsearch_round_errors_total", "没有得到可用模型输出、需要重试的轮数")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug("metrics: " + format, *args)
+
+
+_metrics_server: ThreadingHTTPServer | None = None
+
+
+def start_metrics_server(port: int | None = None, host: str = "0.0.0.0") -> ThreadingHTTPServer | None:
+    """
+    在后台线程中启动 Prometheus 指标端点（GET /metrics）
+
+    port 默认读取 METRICS_PORT，未设置或为 0 时不启动；重复调用返回已启动的服务。
+    """
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+    port = port if port is not None else int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _metrics_server.daemon_threads = True
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Prometheus 指标端点: http://%s:%d/metrics", host, port)
+    return _metrics_server
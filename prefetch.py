@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Iterable
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+from tools import ScrapTool
+from urls import canonicalize_url
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("deepsearch_prefetch_total", "URL 预取次数（按结果；used 表示之后确实被抓取）")
+
+
+class Prefetcher:
+    """
+    预取模型记下的 URL
+
+    提示词要求模型把"稍后要抓取的 URL"写进记忆块，下一轮的抓取目标通常提前一次模型调用就已知。
+    每轮更新工作区后，把新记忆块和重要链接中的 URL 交给 schedule()，在下一次模型调用期间
+    于后台抓取并提取到抓取缓存中；模型随后请求抓取这些 URL 时直接命中缓存，
+    或者加入仍在进行中的预取请求（见 ScrapTool.get_page）。
+
+    每个任务最多预取 budget 个 URL，同时进行的预取不超过 concurrency 个。
+    抓取缓存关闭时预取的结果无处保存，不启用。
+    """
+
+    def __init__(
+        self,
+        scraper: ScrapTool,
+        budget: int | None = None,
+        concurrency: int | None = None,
+    ) -> None:
+        self.scraper = scraper
+        self.budget = budget if budget is not None else int(os.getenv("PREFETCH_BUDGET", "8"))
+        self.concurrency = (
+            concurrency if concurrency is not None else int(os.getenv("PREFETCH_CONCURRENCY", "3"))
+        )
+        # 已安排预取的 URL（规范化）-> 预取任务
+        self.scheduled: Dict[str, asyncio.Future] = {}
+        self._semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0 and self.scraper.cache is not None
+
+    def schedule(self, urls: Iterable[str]) -> int:
+        """安排预取尚未预取过的 URL，返回新安排的数量（超出预算的部分被忽略）"""
+        if not self.enabled:
+            return 0
+        started = 0
+        for url in urls:
+            try:
+                key = canonicalize_url(url)
+            except ValueError:
+                continue
+            if key in self.scheduled:
+                continue
+            if len(self.scheduled) >= self.budget:
+                metrics.inc("deepsearch_prefetch_total", result="over_budget")
+                break
+            self.scheduled[key] = asyncio.ensure_future(self._prefetch(url))
+            started += 1
+        if started:
+            logger.debug("预取 %d 个 URL（已用预算 %d/%d）", started, len(self.scheduled), self.budget)
+        return started
+
+    async def _prefetch(self, url: str) -> None:
+        async with self._semaphore:
+            try:
+                with metrics.span("prefetch"):
+                    await self.scraper.get_page(url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 预取只是投机，失败时由之后真正的抓取报告错误
+                logger.debug("预取 %s 失败: %s", url, e)
+                metrics.inc("deepsearch_prefetch_total", result="failed")
+                return
+        metrics.inc("deepsearch_prefetch_total", result="fetched")
+
+    def mark_used(self, key: str) -> None:
+        """模型请求抓取 key（规范化 URL）时调用，用于统计预取的命中率"""
+        if key in self.scheduled:
+            metrics.inc("deepsearch_prefetch_total", result="used")
+
+    def cancel(self) -> None:
+        """任务结束时取消尚未完成的预取（已经发出的页面请求会继续完成并写入缓存）"""
+        for task in self.scheduled.values():
+            task.cancel()
@@ -1,11 +1,16 @@
+import logging
 from typing import Any, Dict
 from jinja2 import Environment, BaseLoader
 from llm import OpenRouterModel
+from log_config import log_payload
+from metrics import metrics
 from dotenv import load_dotenv
 
 # 加载.env文件中的环境变量
 load_dotenv()
-    
+
+logger = logging.getLogger(__name__)
+
 model = OpenRouterModel()
 
 class Prompt:
@@ -25,12 +30,14 @@ class Prompt:
         generation_args: Dict[str, Any] = {},
     ) -> str:
         global model
-        prompt = self(**prompt_variables)
-        print(f"\nPrompt:\n{prompt}")
+        with metrics.span("render"):
+            prompt = self(**prompt_variables)
+        logger.debug("Prompt: %s", log_payload(prompt))
         try:
-            result = await model(prompt)
-            print(f"\n结果:\n{result}")
+            with metrics.span("llm"):
+                result = await model(prompt, **generation_args)
+            logger.debug("结果: %s", log_payload(result))
             return result
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("模型调用失败")
             raise
\ No newline at end of file
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+
+class TokenBucket:
+    """按每分钟速率匀速补充的令牌桶，容量为一分钟的配额"""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离桶内有足够令牌还需等待的秒数"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """
+    第 attempt 次重试前的等待时间：指数退避加全抖动（在 0 到上限之间均匀随机），
+    避免大量请求在同一时刻重试；服务端给出 Retry-After 时至少等待该时间
+    """
+    base = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+    cap = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class RateLimiter:
+    """
+    进程级共享的异步限速器
+
+    同时按每分钟请求数（RPM）和每分钟 token 数（TPM）限流，配额为 0 表示不限制。
+    收到 429 时调用 block_for()，所有等待者都会暂停到 Retry-After 指定的时间之后。
+    等待者按到达顺序依次获得配额。
+    """
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None) -> None:
+        rpm = rpm if rpm is not None else float(os.getenv("LLM_RPM", "20"))
+        tpm = tpm if tpm is not None else float(os.getenv("LLM_TPM", "0"))
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.blocked_until = 0.0
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """等待直到可以发出一个预计消耗 tokens 个 token 的请求"""
+        async with self._get_lock():
+            while True:
+                now = time.monotonic()
+                wait = self.blocked_until - now
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1, now))
+                if self.tokens is not None and tokens:
+                    wait = max(wait, self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None and tokens:
+                self.tokens.consume(tokens)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """用接口返回的实际 token 数修正之前的预估值"""
+        if self.tokens is None:
+            return
+        if actual < estimated:
+            self.tokens.refund(estimated - actual)
+        else:
+            self.tokens.consume(actual - estimated)
+
+    def block_for(self, seconds: float) -> None:
+        """暂停所有请求 seconds 秒（用于处理 429 Retry-After）"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# 所有 Agent 共享同一个限速器
+rate_limiter = RateLimiter()
@@ -0,0 +1,116 @@
+import heapq
+import math
+import os
+import re
+from collections import Counter
+from typing import List, NamedTuple, Tuple
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_CJK_RUN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    适用于中英文混合文本的分词：英文/数字按单词切分，中日韩文字按相邻二字切分
+
+    例如 "新加坡书店 opening hours" -> ["新加", "加坡", "坡书", "书店", "opening", "hours"]
+    """
+    text = text.lower()
+    tokens = _WORD_PATTERN.findall(text)
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+    return tokens
+
+
+class BM25Index:
+    """
+    BM25 打分
+
+    每个文档只保存词频表（Counter 由 C 实现，建索引很快）；查询时只查找查询中的词项，
+    开销为 文档数 × 查询词项数 次字典查找，与文档长度无关。
+    """
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        self.term_freqs = [Counter(doc) for doc in documents]
+        lengths = [len(doc) for doc in documents]
+        avg_length = (sum(lengths) / self.size) if self.size else 0.0
+        # 文档长度归一化项只与文档有关，预先算好
+        self.norms = [
+            k1 * (1 - b + b * length / avg_length) if avg_length else k1 for length in lengths
+        ]
+
+    def scores(self, query: List[str]) -> List[float]:
+        scores = [0.0] * self.size
+        for term in set(query):
+            hits = [(doc_id, tf[term]) for doc_id, tf in enumerate(self.term_freqs) if term in tf]
+            if not hits:
+                continue
+            df = len(hits)
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            for doc_id, tf in hits:
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.norms[doc_id])
+        return scores
+
+    def top(self, query: List[str], n: int) -> List[Tuple[int, float]]:
+        """得分最高的 n 个 (doc_id, score)，不含得分为 0 的文档"""
+        scored = ((score, doc_id) for doc_id, score in enumerate(self.scores(query)) if score > 0)
+        return [(doc_id, score) for score, doc_id in heapq.nlargest(n, scored)]
+
+
+class Passage(NamedTuple):
+    offset: int  # 在原文中的字符偏移
+    text: str
+
+
+def split_passages(text: str, max_chars: int) -> List[Passage]:
+    """按行把文本合并为不超过 max_chars 的段落，过长的单行按长度硬切"""
+    passages = []
+    start = 0
+    end = 0
+    for line in text.splitlines(keepends=True):
+        if end > start and end - start + len(line) > max_chars:
+            passages.append(Passage(start, text[start:end].strip()))
+            start = end
+        end += len(line)
+        while end - start > max_chars:
+            passages.append(Passage(start, text[start:start + max_chars].strip()))
+            start += max_chars
+    if end > start:
+        passages.append(Passage(start, text[start:end].strip()))
+    return [passage for passage in passages if passage.text]
+
+
+class PassageIndex:
+    """
+    单个页面的段落索引
+
+    页面切分为段落，每个段落保存一份词频表（见 BM25Index）；search() 对所有段落做 BM25 打分，
+    返回与查询最相关的段落（按原文顺序）。
+    """
+
+    def __init__(self, text: str, max_chars: int | None = None) -> None:
+        max_chars = max_chars or int(os.getenv("PASSAGE_MAX_CHARS", "600"))
+        self.passages = split_passages(text, max_chars)
+        self.index = BM25Index([tokenize(passage.text) for passage in self.passages])
+
+    def search(self, query: str, top_n: int) -> List[Passage]:
+        hits = self.index.top(tokenize(query), top_n)
+        if not hits:
+            # 没有任何段落命中时退回页面开头
+            return self.passages[:top_n]
+        return [self.passages[doc_id] for doc_id in sorted(doc_id for doc_id, _ in hits)]
+
+
+def format_passages(passages: List[Passage]) -> str:
+    return "\n\n".join(f"[位置 {passage.offset}] {passage.text}" for passage in passages)
@@ -74,10 +74,20 @@ def main():
     
     try:
         from app import Web_UI
+        from http_client import http_client
+        from log_config import setup_logging
+        from metrics import start_metrics_server
+        setup_logging()
+        # 设置了 METRICS_PORT 时与 Gradio 一起提供 Prometheus 指标端点
+        start_metrics_server()
         print("正在启动DeepSearch Framework Web界面...")
         print(f"监听地址: {host}:{port}")
         print(f"浏览器访问地址: http://{host if host != '0.0.0.0' else 'localhost'}:{port}")
-        Web_UI.launch(server_name='0.0.0.0', server_port=port, favicon_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "favicon.ico"))
+        try:
+            Web_UI.launch(server_name='0.0.0.0', server_port=port, favicon_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "favicon.ico"))
+        finally:
+            # 服务退出时关闭共享连接池
+            http_client.close_sync()
     except Exception as e:
         print(f"启动Web界面时发生错误: {e}")
         sys.exit(1)
@@ -0,0 +1,107 @@
+import asyncio
+import contextlib
+import os
+from collections import Counter, OrderedDict, deque
+from typing import AsyncIterator, Deque
+
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+
+class SchedulerFull(Exception):
+    """排队的任务已达上限"""
+
+
+class FairScheduler:
+    """
+    带全局并发上限和按用户公平排队的异步任务调度器
+
+    - 同时运行的任务不超过 max_concurrency 个，其余任务排队，排队总数不超过 max_queue
+    - 每个用户同时运行的任务不超过 per_user 个（0 表示不限制）
+    - 有空位时按用户轮转放行：每个用户依次放行一个任务，提交很多任务的用户不会让其他用户一直等待
+
+    用法:
+        async with scheduler.slot(session_id):
+            await run_task()
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        max_queue: int | None = None,
+        per_user: int | None = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency or int(os.getenv("TASK_CONCURRENCY", "4"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("TASK_QUEUE_LIMIT", "64"))
+        self.per_user = per_user if per_user is not None else int(os.getenv("TASK_PER_USER_LIMIT", "1"))
+        self.running = 0
+        self._active: Counter = Counter()
+        # 用户 -> 该用户排队中的任务；字典顺序即轮转顺序
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _can_run(self, user: str) -> bool:
+        return not self.per_user or self._active[user] < self.per_user
+
+    def _wake(self) -> None:
+        while self.running < self.max_concurrency:
+            user = next((u for u in self._queues if self._can_run(u)), None)
+            if user is None:
+                return
+            queue = self._queues[user]
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if future.cancelled():
+                # 调用方已取消，尚未来得及从队列中移除
+                continue
+            self.running += 1
+            self._active[user] += 1
+            future.set_result(None)
+
+    def _release(self, user: str) -> None:
+        self.running -= 1
+        self._active[user] -= 1
+        if not self._active[user]:
+            del self._active[user]
+        self._wake()
+
+    async def _acquire(self, user: str) -> None:
+        if self.max_queue and self.waiting >= self.max_queue:
+            raise SchedulerFull(f"排队任务已达上限 {self.max_queue}")
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经获得名额但调用方被取消，归还名额
+                self._release(user)
+            else:
+                queue = self._queues.get(user)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._queues[user]
+            raise
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user: str) -> AsyncIterator[None]:
+        """等待一个运行名额，退出时归还"""
+        await self._acquire(user)
+        try:
+            yield
+        finally:
+            self._release(user)
+
+
+# Web 界面的所有会话共享
+scheduler = FairScheduler()
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+from urls import canonicalize_url
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+
+class CachedPage(TypedDict):
+    url: str
+    body: str
+    text: str
+    links: List[Tuple[str, str]]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class ScrapeCache:
+    """
+    持久化的网页抓取缓存
+
+    以规范化 URL 的 sha256 作为键，保存原始页面和提取后的文本/链接，
+    过期后通过 ETag / Last-Modified 条件请求重新验证。
+    总大小超过上限时按最近访问时间（LRU）淘汰。
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+    ) -> None:
+        self.path = path or os.getenv("SCRAPE_CACHE_PATH", ".cache/scrape_cache.sqlite3")
+        self.ttl = ttl if ttl is not None else float(os.getenv("SCRAPE_CACHE_TTL", "86400"))
+        self.max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else int(float(os.getenv("SCRAPE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        )
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "evictions": 0}
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(canonicalize_url(url).encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    text TEXT NOT NULL,
+                    links TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page["fetched_at"] < self.ttl
+
+    def lookup(self, url: str) -> Tuple[Optional[CachedPage], bool]:
+        """
+        查找缓存页面
+
+        Returns:
+            (page, fresh): 未命中时 page 为 None；fresh 表示是否可以直接使用
+        """
+        key = self.key(url)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT url, body, text, links, etag, last_modified, fetched_at "
+                "FROM pages WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None, False
+            conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+
+        page = CachedPage(
+            url=row[0],
+            body=zlib.decompress(row[1]).decode("utf-8"),
+            text=row[2],
+            links=[tuple(link) for link in json.loads(row[3])],
+            etag=row[4],
+            last_modified=row[5],
+            fetched_at=row[6],
+        )
+        fresh = self.is_fresh(page)
+        self.stats["hits" if fresh else "stale"] += 1
+        return page, fresh
+
+    def has_fresh(self, url: str) -> bool:
+        """是否有未过期的缓存页面（不计入命中统计，也不更新访问时间）"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT fetched_at FROM pages WHERE key = ?", (self.key(url),)
+            ).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def put(
+        self,
+        url: str,
+        body: str,
+        text: str,
+        links: List[Tuple[str, str]],
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> CachedPage:
+        now = time.time()
+        compressed = zlib.compress(body.encode("utf-8"))
+        links_json = json.dumps(links, ensure_ascii=False)
+        size = len(compressed) + len(text.encode("utf-8")) + len(links_json.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(key, url, body, text, links, etag, last_modified, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.key(url), canonicalize_url(url), compressed, text, links_json,
+                 etag, last_modified, now, now, size),
+            )
+            self._evict(conn)
+            conn.commit()
+        return CachedPage(
+            url=canonicalize_url(url),
+            body=body,
+            text=text,
+            links=links,
+            etag=etag,
+            last_modified=last_modified,
+            fetched_at=now,
+        )
+
+    def refresh(self, url: str) -> None:
+        """服务端返回 304 后，延长缓存页面的有效期"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, self.key(url)),
+            )
+            conn.commit()
+            self.stats["revalidated"] += 1
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, size FROM pages ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def summary(self) -> Dict[str, int]:
+        """命中统计以及当前条目数和占用字节数"""
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+        return {**self.stats, "entries": entries, "bytes": size}
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM pages")
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_scrape_cache: ScrapeCache | None = None
+
+
+def get_scrape_cache() -> ScrapeCache | None:
+    """返回进程级共享的抓取缓存；SCRAPE_CACHE=off 时禁用"""
+    global _scrape_cache
+    if os.getenv("SCRAPE_CACHE", "on").lower() in ("off", "0", "false", "no"):
+        return None
+    if _scrape_cache is None:
+        _scrape_cache = ScrapeCache()
+        cache = _scrape_cache
+        metrics.register_stats(
+            "deepsearch_scrape_cache_events_total", "抓取缓存的命中、未命中、过期、重新验证和淘汰次数",
+            lambda: dict(cache.stats), "event",
+        )
+    return _scrape_cache
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+
+def normalize_query(query: str) -> str:
+    """
+    规范化搜索词：Unicode NFKC、大小写折叠、合并空白
+
+    例如 "  Singapore　 书店 " 与 "singapore 书店" 得到相同的结果。
+    """
+    query = unicodedata.normalize("NFKC", query)
+    query = query.casefold()
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class MemorySearchBackend:
+    """进程内的 LRU 缓存，条目各自带过期时间"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 2048) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SqliteSearchBackend:
+    """持久化到 SQLite 的缓存，可在多个进程/重启之间共享"""
+
+    blocking = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS search_results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM search_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO search_results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+            conn.execute("DELETE FROM search_results WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+
+
+class SearchCache:
+    """
+    SearchTool 前置的结果缓存
+
+    键由规范化后的搜索词和搜索参数构成；并发的相同查询共享同一次上游请求。
+    """
+
+    def __init__(self, backend=None, ttl: float | None = None) -> None:
+        self.backend = backend or MemorySearchBackend()
+        self.ttl = ttl if ttl is not None else float(os.getenv("SEARCH_CACHE_TTL", "21600"))
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def key(query: str, params: Dict[str, Any] | None = None) -> str:
+        raw = json.dumps(
+            {"query": normalize_query(query), **(params or {})},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def _backend_call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get_or_fetch(
+        self,
+        query: str,
+        fetch: Callable[[], Awaitable[List[Any]]],
+        params: Dict[str, Any] | None = None,
+        ttl: float | None = None,
+    ) -> List[Any]:
+        key = self.key(query, params)
+
+        cached = await self._backend_call(self.backend.get, key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+
+        # 已有相同的查询在进行中时直接等待它的结果。上游请求运行在独立的任务中，
+        # 某个调用方被取消不会影响其他等待者
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(
+        self, key: str, fetch: Callable[[], Awaitable[List[Any]]], ttl: float | None
+    ) -> List[Any]:
+        results = await fetch()
+        # 空结果通常意味着上游出错，不缓存
+        if results:
+            await self._backend_call(
+                self.backend.set, key, results, ttl if ttl is not None else self.ttl
+            )
+        return results
+
+    def _on_done(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        # 所有调用方都已取消时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+
+_search_cache: SearchCache | None = None
+
+
+def get_search_cache() -> SearchCache | None:
+    """
+    返回进程级共享的搜索缓存
+
+    SEARCH_CACHE=memory（默认）、sqlite 或 off
+    """
+    global _search_cache
+    kind = os.getenv("SEARCH_CACHE", "memory").lower()
+    if kind in ("off", "0", "false", "no"):
+        return None
+    if _search_cache is None:
+        if kind == "sqlite":
+            backend = SqliteSearchBackend(
+                os.getenv("SEARCH_CACHE_PATH", ".cache/search_cache.sqlite3")
+            )
+        else:
+            backend = MemorySearchBackend()
+        _search_cache = SearchCache(backend)
+        cache = _search_cache
+        metrics.register_stats(
+            "deepsearch_search_cache_events_total", "搜索缓存的命中、未命中和合并请求次数",
+            lambda: dict(cache.stats), "event",
+        )
+    return _search_cache
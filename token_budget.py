@@ -0,0 +1,232 @@
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List
+
+from dotenv import load_dotenv
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from llm import estimate_tokens
+from retrieval import BM25Index, tokenize
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 被裁剪的片段之间插入的省略标记
+ELLIPSIS = "\n...\n"
+
+# 工作区中的记忆块：<abc-123>内容</abc-123>，按添加顺序排列（最早的在前）
+_BLOCK = re.compile(r"<([a-z]{3}-\d{3})>(.*?)</\1>\n?", re.DOTALL)
+
+
+class PromptBudget:
+    """
+    每轮提示词的 token 预算
+
+    先渲染不含工作区和工具结果的模板，得到固定开销；剩余预算中工作区最多占
+    workspace_share，其余按“注水”方式平分给各条工具结果：小于平均份额的结果原样保留，
+    省下的额度再分给较大的结果。超出份额的工具结果用 langchain 的文本切分器分块，
+    按与任务和工具输入的 BM25 相关性排序，保留得分最高的块（首块总是保留）并按原顺序拼接。
+    工作区按记忆块整体裁剪：从最早的记忆块开始丢弃，最新的记忆块优先保留。
+
+    max_tokens 为 0 时不做任何裁剪，只统计各部分的 token 数。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        workspace_share: float | None = None,
+        chunk_tokens: int | None = None,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ) -> None:
+        self.max_tokens = (
+            max_tokens if max_tokens is not None else int(os.getenv("PROMPT_TOKEN_BUDGET", "32000"))
+        )
+        self.workspace_share = (
+            workspace_share
+            if workspace_share is not None
+            else float(os.getenv("PROMPT_WORKSPACE_SHARE", "0.4"))
+        )
+        chunk_tokens = chunk_tokens or int(os.getenv("PROMPT_CHUNK_TOKENS", "200"))
+        self.count_tokens = count_tokens
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_tokens,
+            chunk_overlap=0,
+            length_function=count_tokens,
+            separators=["\n\n", "\n", "。", ". ", " ", ""],
+        )
+
+    def fit(self, text: str, budget: int, query: str | None = None) -> str:
+        """把 text 裁剪到 budget 个 token 以内；query 为空时按原顺序保留开头部分"""
+        if budget <= 0:
+            return ""
+        if self.count_tokens(text) <= budget:
+            return text
+
+        chunks = self.splitter.split_text(text)
+        sizes = [self.count_tokens(chunk) for chunk in chunks]
+        order = list(range(len(chunks)))
+        if query:
+            index = BM25Index([tokenize(chunk) for chunk in chunks])
+            scores = index.scores(tokenize(query))
+            order = [0] + sorted(order[1:], key=lambda i: -scores[i])
+
+        separator_cost = self.count_tokens(ELLIPSIS)
+        kept = []
+        used = 0
+        for i in order:
+            cost = sizes[i] + separator_cost
+            if used + cost > budget:
+                continue
+            kept.append(i)
+            used += cost
+        if not kept:
+            # 连一个块都放不下时直接按字符截断首块
+            return chunks[0][:budget]
+        kept.sort()
+
+        pieces = [chunks[kept[0]]]
+        for prev, i in zip(kept, kept[1:]):
+            pieces.append(("\n" if i == prev + 1 else ELLIPSIS) + chunks[i])
+        if kept[-1] != len(chunks) - 1:
+            pieces.append(ELLIPSIS)
+        return "".join(pieces)
+
+    def fit_workspace(self, workspace: str, budget: int) -> str:
+        """
+        把工作区裁剪到 budget 个 token 以内
+
+        状态行和重要链接原样保留；记忆块从最新的开始往前保留，放不下的第一个块截断内容
+        （保留完整的块标签），更早的块整体丢弃并注明省略的数量。
+        """
+        if self.count_tokens(workspace) <= budget:
+            return workspace
+        matches = list(_BLOCK.finditer(workspace))
+        if not matches:
+            return self.fit(workspace, budget)
+
+        head = workspace[: matches[0].start()]
+        tail = workspace[matches[-1].end():]
+        note = "... 已省略 {} 个较早的记忆块 ...\n"
+        remaining = budget - self.count_tokens(head + note.format(len(matches)) + tail)
+        kept: List[str] = []
+        for match in reversed(matches):
+            cost = self.count_tokens(match.group(0))
+            if cost <= remaining:
+                kept.append(match.group(0))
+                remaining -= cost
+                continue
+            block_id = match.group(1)
+            content_budget = remaining - self.count_tokens(f"<{block_id}></{block_id}>\n")
+            if content_budget > 0:
+                content = self.fit(match.group(2), content_budget)
+                kept.append(f"<{block_id}>{content}</{block_id}>\n")
+            break
+
+        dropped = len(matches) - len(kept)
+        if dropped:
+            head += note.format(dropped)
+        fitted = head + "".join(reversed(kept)) + tail
+        # 状态行和重要链接本身就超出预算时只能按文本裁剪
+        return fitted if self.count_tokens(fitted) <= budget else self.fit(fitted, budget)
+
+    def _allocate(self, sizes: List[int], budget: int) -> List[int]:
+        """注水分配：小的结果全额保留，剩余额度平分给其余结果"""
+        shares = [0] * len(sizes)
+        remaining = sorted(range(len(sizes)), key=lambda i: sizes[i])
+        while remaining:
+            fair = budget // len(remaining)
+            i = remaining[0]
+            if sizes[i] > fair:
+                for j in remaining:
+                    shares[j] = fair
+                break
+            shares[i] = sizes[i]
+            budget -= sizes[i]
+            remaining.pop(0)
+        return shares
+
+    def apply(
+        self,
+        render: Callable[..., str],
+        variables: Dict[str, Any],
+        task: str = "",
+        label: str = "",
+    ) -> Dict[str, Any]:
+        """
+        返回裁剪后的提示词变量（不修改传入的 variables），并记录各部分的 token 数：
+        发生裁剪时记在 INFO 日志中，否则只在 DEBUG 日志中记录
+
+        variables 需包含 workspace（字符串）和 tool_records（[{tool, input, output}] 或 None）
+        """
+        workspace = variables.get("workspace") or ""
+        records = variables.get("tool_records") or []
+
+        fixed = self.count_tokens(render(**{**variables, "workspace": "", "tool_records": None}))
+        workspace_tokens = self.count_tokens(workspace)
+        output_tokens = [self.count_tokens(str(record.get("output", ""))) for record in records]
+
+        fitted_workspace = workspace
+        fitted_records = records
+        if self.max_tokens > 0:
+            available = max(0, self.max_tokens - fixed)
+            workspace_budget = min(workspace_tokens, int(available * self.workspace_share))
+            # 工具结果用不完的额度留给工作区
+            workspace_budget = max(workspace_budget, available - sum(output_tokens))
+            fitted_workspace = self.fit_workspace(workspace, workspace_budget)
+            shares = self._allocate(
+                output_tokens, available - self.count_tokens(fitted_workspace)
+            )
+            fitted_records = [
+                {
+                    **record,
+                    "output": self.fit(
+                        str(record.get("output", "")), share, f"{task} {record.get('input', '')}"
+                    ),
+                }
+                if size > share
+                else record
+                for record, size, share in zip(records, output_tokens, shares)
+            ]
+
+        fitted = {
+            **variables,
+            "workspace": fitted_workspace,
+            "tool_records": fitted_records or variables.get("tool_records"),
+        }
+        trimmed = fitted_workspace is not workspace or any(
+            fitted_record is not record for record, fitted_record in zip(records, fitted_records)
+        )
+        level = logging.INFO if trimmed else logging.DEBUG
+        if logger.isEnabledFor(level):
+            # 统计各部分的 token 数需要再渲染一次完整的提示词，只在裁剪或调试时进行
+            self._log(level, label, fixed, workspace, fitted_workspace, records, fitted_records, render(**fitted))
+        return fitted
+
+    def _log(
+        self,
+        level: int,
+        label: str,
+        fixed: int,
+        workspace: str,
+        fitted_workspace: str,
+        records: List[Dict[str, Any]],
+        fitted_records: List[Dict[str, Any]],
+        prompt: str,
+    ) -> None:
+        def section(before: int, after: int) -> str:
+            return f"{before}" if before == after else f"{before}->{after}"
+
+        lines = [
+            f"\nToken 预算{(' ' + label) if label else ''}: "
+            f"{self.count_tokens(prompt)}/{self.max_tokens or '不限'}",
+            f"  模板: {fixed}",
+            f"  工作区: {section(self.count_tokens(workspace), self.count_tokens(fitted_workspace))}",
+        ]
+        for i, (record, fitted) in enumerate(zip(records, fitted_records), 1):
+            before = self.count_tokens(str(record.get("output", "")))
+            after = self.count_tokens(str(fitted.get("output", "")))
+            lines.append(f"  来源 {i} {record.get('tool')}: {record.get('input')}: {section(before, after)}")
+        logger.log(level, "\n".join(lines))
@@ -1,170 +1,421 @@
 import os
+import asyncio
+import logging
+import threading
 import aiohttp
-from typing import TypedDict, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, TypedDict, List, Tuple
 from tavily import TavilyClient
-import re
-import json
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
+from extractors import (
+    PdfReader,
+    clean_text,
+    content_kind,
+    decode_body,
+    extract_json,
+    extract_pdf,
+    get_extractor,
+    sniff_kind,
+)
+from http_client import HttpClient, http_client
+from json_stream import find_largest_json_object
+from retrieval import PassageIndex, format_passages
+from scrape_cache import ScrapeCache, get_scrape_cache
+from search_cache import SearchCache, get_search_cache
+from urls import canonicalize_url
+
 # 加载.env文件中的环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def extract_largest_json(text):
     """
     从文本中提取最大的JSON对象
+
+    单遍扫描找出所有顶层 {...} 片段（正确处理字符串、转义和任意嵌套深度），
+    再按长度从大到小解析，返回第一个合法对象。
     """
-    json_pattern = r'\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}'
-    matches = re.findall(json_pattern, text)
-    
-    if not matches:
-        return None
-    
-    # 按长度排序，取最长的
-    matches.sort(key=len, reverse=True)
-    
-    for match in matches:
-        try:
-            return json.loads(match)
-        except json.JSONDecodeError:
-            continue
-    
-    return None
+    return find_largest_json_object(text)
+
+class PageFetchError(Exception):
+    """页面无法获取（非 200 状态码、网络错误等），消息作为失败的工具输出返回"""
+
 
 class ScrapTool:
-    def __init__(self, gather_links: bool = True) -> None:
+    def __init__(
+        self,
+        gather_links: bool = True,
+        http: HttpClient | None = None,
+        cache: ScrapeCache | None = None,
+        top_n: int | None = None,
+        extractor=None,
+    ) -> None:
         self.gather_links = gather_links
+        self.http = http or http_client
+        self.cache = cache if cache is not None else get_scrape_cache()
+        # HTML 提取引擎（HTML_EXTRACTOR，默认自动选择已安装的最快实现）
+        self.extractor = extractor or get_extractor()
+        # 单个页面最多读取的字节数，以及 PDF 最多提取的页数
+        self.max_bytes = int(os.getenv("SCRAPE_MAX_BYTES", str(5 * 1024 * 1024)))
+        self.pdf_max_pages = int(os.getenv("SCRAPE_PDF_MAX_PAGES", "30"))
+        # 有上下文时只返回最相关的 top_n 个段落
+        self.top_n = top_n or int(os.getenv("SCRAPE_TOP_PASSAGES", "8"))
+        # 最近页面的段落索引（以正文为键），同一页面换个查询无需重新建索引
+        self._indexes: "OrderedDict[str, PassageIndex]" = OrderedDict()
+        self._max_indexes = 32
+        # filter_relevant 在线程中运行，索引缓存需要加锁
+        self._indexes_lock = threading.Lock()
+        # 进行中的页面请求（以规范化 URL 为键），预取和工具调用抓取同一页面时共享
+        self._inflight: Dict[str, asyncio.Task] = {}
 
     async def __call__(self, input: str, context: str | None) -> str:
-        try:
-            result = await self.scrap_webpage(input, context)
-            return result
-        except Exception as e:
-            error_message = f"抓取网页失败: {str(e)}"
-            print(error_message)
-            return error_message
+        """抓取失败时抛出 PageFetchError（由 Agent 标记为失败的调用，不会被记住）"""
+        return await self.scrap_webpage(input, context)
 
     async def scrap_webpage(self, url: str, context: str | None) -> str:
         # 如果URL不是以http或https开头，添加https前缀
         if not url.startswith(('http://', 'https://')):
             url = f"https://{url}"
 
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30) as response:
-                    if response.status != 200:
-                        return f"无法获取页面 {url}: HTTP状态码 {response.status}"
-                    html = await response.text()
-            
-            # 使用BeautifulSoup解析HTML
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # 移除JavaScript和CSS
-            for script in soup(["script", "style"]):
-                script.extract()
-            
-            # 获取文本内容
-            text = soup.get_text()
-            
-            # 清理文本（删除多余空行和空格）
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            
-            # 如果需要收集链接
-            if self.gather_links:
-                links = []
-                for link in soup.find_all('a', href=True):
-                    href = link.get('href')
-                    # 处理相对URL
-                    if href.startswith('/'):
-                        base_url = re.match(r'https?://[^/]+', url)
-                        if base_url:
-                            href = f"{base_url.group(0)}{href}"
-                    elif not href.startswith(('http://', 'https://')):
-                        href = f"{url.rstrip('/')}/{href.lstrip('/')}"
-                    
-                    link_text = link.get_text().strip()
-                    if link_text and href:
-                        links.append(f"{link_text}: {href}")
-                
-                if links:
-                    text += "\n\n链接摘要:\n" + "\n".join(links)
-            
-            # 如果提供了上下文，可以简单地根据上下文关键词过滤内容
+            text, links = await self.get_page(url)
+
+            # 如果提供了上下文，只保留与之最相关的段落（BM25 检索）；
+            # 大页面建索引需要上百毫秒，放到线程中执行，不阻塞事件循环
             if context is not None:
-                # 简单的上下文匹配 - 提取包含上下文关键词的段落
-                context_keywords = context.lower().split()
-                paragraphs = text.split('\n\n')
-                relevant_paragraphs = []
-                
-                for para in paragraphs:
-                    if any(keyword in para.lower() for keyword in context_keywords):
-                        relevant_paragraphs.append(para)
-                
-                if relevant_paragraphs:
-                    text = '\n\n'.join(relevant_paragraphs)
-            
+                text = await asyncio.to_thread(self.filter_relevant, text, context)
+
+            # 如果需要收集链接
+            if self.gather_links and links:
+                text += "\n\n链接摘要:\n" + "\n".join(
+                    f"{link_text}: {href}" for link_text, href in links
+                )
+
             return text
 
+        except PageFetchError:
+            raise
         except Exception as e:
-            return f"抓取 {url} 时出错: {str(e)}"
+            raise PageFetchError(f"抓取 {url} 时出错: {str(e)}") from e
+
+    def filter_relevant(self, text: str, query: str) -> str:
+        """
+        返回与查询最相关的 top_n 个段落（按原文顺序，带字符偏移）
+
+        段落按中英文混合分词（中日韩文字取二字组）建立 BM25 索引，
+        对中文任务同样有效；没有任何段落命中时返回页面开头的段落。
+        """
+        with self._indexes_lock:
+            index = self._indexes.get(text)
+            if index is not None:
+                self._indexes.move_to_end(text)
+        if index is None:
+            # 在锁外建索引，并发的不同页面互不等待
+            index = PassageIndex(text)
+            with self._indexes_lock:
+                self._indexes[text] = index
+                if len(self._indexes) > self._max_indexes:
+                    self._indexes.popitem(last=False)
+        return format_passages(index.search(query, self.top_n))
+
+    async def store_page(
+        self, url: str, body: str, text: str, links: List[Tuple[str, str]]
+    ) -> None:
+        """
+        把从其他途径（如搜索结果的原文）得到的页面写入抓取缓存
+
+        已有未过期的缓存时不覆盖：真正抓取得到的提取结果带有链接，比搜索结果的原文更完整
+        """
+        if self.cache is None:
+            return
+        cache = self.cache
+
+        def put_if_missing() -> None:
+            if not cache.has_fresh(url):
+                cache.put(url, body, text, links)
+
+        await asyncio.to_thread(put_if_missing)
+
+    async def get_page(self, url: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """
+        获取页面的提取结果 (text, links)
+
+        缓存命中且未过期时直接返回，既不访问网络也不解析 HTML；
+        过期时带上 ETag / Last-Modified 进行条件请求，304 时沿用缓存内容。
+        同一页面已有请求在进行中（例如后台预取）时直接等待它的结果，
+        请求运行在独立的任务中，某个调用方被取消不会影响其他等待者。
+        """
+        try:
+            key = canonicalize_url(url)
+        except ValueError:
+            key = url
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_page(url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_fetched(key, t))
+        return await asyncio.shield(task)
+
+    def _on_fetched(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        # 所有调用方都已取消时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch_page(self, url: str) -> Tuple[str, List[Tuple[str, str]]]:
+        cached = None
+        if self.cache is not None:
+            cached, fresh = await asyncio.to_thread(self.cache.lookup, url)
+            if cached is not None and fresh:
+                return cached["text"], cached["links"]
+
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        }
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        session = self.http.session()
+        async with session.get(
+            url, headers=headers, timeout=self.http.timeout("scrape")
+        ) as response:
+            if response.status == 304 and cached is not None:
+                await asyncio.to_thread(self.cache.refresh, url)
+                return cached["text"], cached["links"]
+            if response.status != 200:
+                raise PageFetchError(f"无法获取页面 {url}: HTTP状态码 {response.status}")
+
+            # 先根据响应头判断类型和大小，不支持的内容不读取响应体
+            kind = content_kind(response.content_type)
+            if kind is None:
+                raise PageFetchError(f"不支持的内容类型 {response.content_type}: {url}")
+            if kind == "pdf":
+                self._check_pdf(url, response.content_length)
+            body, truncated = await self._read_body(response)
+            if kind == "unknown":
+                kind = sniff_kind(body[:1024])
+                if kind is None:
+                    raise PageFetchError(f"不支持的二进制内容: {url}")
+                if kind == "pdf":
+                    self._check_pdf(url, None if truncated else len(body))
+            if kind == "pdf" and truncated:
+                raise PageFetchError(f"PDF 超过大小上限 {self.max_bytes} 字节: {url}")
+
+            charset = response.charset
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        # 解码和解析是 CPU 密集操作，放到线程中执行，不阻塞事件循环
+        source, text, links = await asyncio.to_thread(
+            self.extract_body, body, kind, charset, url
+        )
+        if truncated:
+            text += f"\n（内容超过 {self.max_bytes} 字节，已截断）"
+
+        if self.cache is not None:
+            await asyncio.to_thread(
+                self.cache.put, url, source, text, links, etag, last_modified
+            )
+        return text, links
+
+    def _check_pdf(self, url: str, length: int | None) -> None:
+        if PdfReader is None:
+            raise PageFetchError(f"未安装 pypdf，无法提取 PDF: {url}")
+        if length is not None and length > self.max_bytes:
+            raise PageFetchError(f"PDF 超过大小上限 {self.max_bytes} 字节: {url}")
+
+    async def _read_body(self, response: aiohttp.ClientResponse) -> Tuple[bytes, bool]:
+        """
+        分块读取响应体，超过 max_bytes 时立即停止
+
+        返回 (body, truncated)；提前退出时连接会被关闭而不是读完剩余内容。
+        """
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.max_bytes:
+                response.close()
+                return b"".join(chunks)[:self.max_bytes], True
+        return b"".join(chunks), False
+
+    def extract_body(
+        self, body: bytes, kind: str, charset: str | None, url: str
+    ) -> Tuple[str, str, List[Tuple[str, str]]]:
+        """按内容类别提取，返回 (用于缓存的源文本, 正文, 链接)"""
+        if kind == "pdf":
+            # PDF 的源文件不是文本，缓存中只保存提取结果
+            return "", extract_pdf(body, self.pdf_max_pages), []
+        source = decode_body(body, charset, html=kind == "html")
+        if kind == "html":
+            text, links = self.extract(source, url)
+            return source, text, links
+        if kind == "json":
+            return source, extract_json(source), []
+        return source, clean_text(source), []
+
+    def extract(self, html: str, url: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """从 HTML 中提取清理后的正文和 (链接文本, 绝对 URL) 列表"""
+        return self.extractor.extract(html, url)
         
 
 class SearchResult(TypedDict):
     url: str
     title: str
     description: str
+    content: str  # 增强模式下页面原文经提取后的文本，否则为空
 
 
 class SearchTool:
-    def __init__(self, timeout: int = 60 * 5) -> None:
-        self.timeout = timeout
+    def __init__(
+        self,
+        timeout: float | None = None,
+        backend: str | None = None,
+        max_workers: int = 4,
+        http: HttpClient | None = None,
+        cache: SearchCache | None = None,
+        scraper: ScrapTool | None = None,
+        enrich_top_k: int | None = None,
+    ) -> None:
+        self.http = http or http_client
+        self.cache = cache if cache is not None else get_search_cache()
+        # 增强模式：请求前 k 条结果的页面原文，经 ScrapTool 相同的提取/相关性流程处理后
+        # 直接附在搜索结果中，并写入抓取缓存，之后 scrape 这些 URL 无需再访问网络
+        self.enrich_top_k = (
+            enrich_top_k if enrich_top_k is not None else int(os.getenv("SEARCH_ENRICH_TOP_K", "0"))
+        )
+        self.enrich_max_chars = int(os.getenv("SEARCH_ENRICH_MAX_CHARS", "2000"))
+        self.scraper = scraper or ScrapTool(http=self.http)
+        self.timeout = timeout or self.http.timeouts["search"]
+        # "aiohttp": 直接异步调用 Tavily REST API；"executor": 在有界线程池中运行同步 TavilyClient
+        self.backend = backend or os.getenv("SEARCH_BACKEND", "aiohttp")
+        self.base_url = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com").rstrip("/")
+        self.max_workers = max_workers
         self.tavily_client = None
+        self._executor = None
         # 初始化时先不创建客户端，因为可能还没有设置 API 密钥
 
     async def __call__(self, input: str, *args) -> str:
+        context = args[0] if args else None
         results = await self.search(input)
-        formatted_results = self._format_results(results)
+        # 附带的页面正文按搜索词和任务检索相关段落
+        query = f"{input} {context}" if context else input
+        # 附带正文时要对每条结果做段落检索，放到线程中执行
+        formatted_results = await asyncio.to_thread(self._format_results, results, query)
         return formatted_results
 
-    async def search(self, query: str) -> List[SearchResult]:
+    def _get_api_key(self) -> str:
+        api_key = os.getenv("TAVILY_API_KEY")
+        if not api_key:
+            raise Exception("TAVILY_API_KEY environment variable not set. Please add it to your .env file.")
+        return api_key
+
+    def _build_payload(self, query: str) -> dict:
+        payload = {
+            "query": query,
+            "search_depth": "basic",  # 或者使用 "advanced"，取决于需求
+        }
+        if self.enrich_top_k > 0:
+            payload["include_raw_content"] = True
+        return payload
+
+    async def _search_aiohttp(self, query: str, api_key: str) -> dict:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        }
+        timeout = aiohttp.ClientTimeout(
+            total=self.timeout, connect=self.http.timeouts["connect"]
+        )
+        session = self.http.session()
+        async with session.post(
+            f"{self.base_url}/search",
+            headers=headers,
+            json=self._build_payload(query),
+            timeout=timeout,
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(
+                    f"Tavily request failed with status {response.status}: {error_text}"
+                )
+            return await response.json()
+
+    async def _search_executor(self, query: str, api_key: str) -> dict:
         # 懒加载 TavilyClient，确保在首次使用时创建
         if self.tavily_client is None:
-            api_key = os.getenv("TAVILY_API_KEY")
-            if not api_key:
-                raise Exception("TAVILY_API_KEY environment variable not set. Please add it to your .env file.")
             self.tavily_client = TavilyClient(api_key=api_key)
+            self.tavily_client.base_url = self.base_url
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="tavily"
+            )
+        # 同步客户端放到线程池中执行，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        call = partial(
+            self.tavily_client.search,
+            **self._build_payload(query),
+            timeout=int(min(self.timeout, 120)),
+        )
+        return await asyncio.wait_for(
+            loop.run_in_executor(self._executor, call), timeout=self.timeout
+        )
+
+    async def search(self, query: str) -> List[SearchResult]:
+        api_key = self._get_api_key()
+
+        if self.cache is None:
+            return await self._search(query, api_key)
 
+        # 缓存键包含除 query 以外的请求参数，参数不同的搜索不会互相命中
+        params = {k: v for k, v in self._build_payload(query).items() if k != "query"}
+        return await self.cache.get_or_fetch(
+            query, lambda: self._search(query, api_key), params=params
+        )
+
+    async def _search(self, query: str, api_key: str) -> List[SearchResult]:
         try:
             # 使用 Tavily 进行搜索
-            response = self.tavily_client.search(
-                query=query,
-                search_depth="basic"  # 或者使用 "advanced"，取决于需求
-            )
+            if self.backend == "executor":
+                response = await self._search_executor(query, api_key)
+            else:
+                response = await self._search_aiohttp(query, api_key)
             
             # 从 Tavily 响应中提取相关信息
             results = []
-            for result in response.get("results", []):
+            for i, result in enumerate(response.get("results", [])):
+                url = result.get("url", "")
+                content = ""
+                raw_content = result.get("raw_content")
+                if i < self.enrich_top_k and url and raw_content:
+                    # Tavily 返回的原文已是纯文本，无需解析 HTML，也没有链接列表
+                    content = clean_text(raw_content)
+                    await self.scraper.store_page(url, raw_content, content, [])
                 results.append(
                     SearchResult(
-                        url=result.get("url", ""),
+                        url=url,
                         title=result.get("title", ""),
-                        description=result.get("content", "")  # Tavily 可能使用 "content" 而不是 "description"
+                        description=result.get("content", ""),  # Tavily 可能使用 "content" 而不是 "description"
+                        content=content,
                     )
                 )
             
             return results
 
         except Exception as e:
-            print(f"Tavily搜索错误: {str(e)}")
-            return []
+            # 不返回空结果：失败的搜索不能被缓存或记入去重账本，之后需要能够重试
+            logger.warning("Tavily搜索错误: %s", e)
+            raise
 
-    def _format_results(self, results: List[SearchResult]) -> str:
+    def _format_results(self, results: List[SearchResult], query: str | None = None) -> str:
         formatted_results = []
 
         for i, result in enumerate(results, 1):
@@ -173,8 +424,17 @@ class SearchTool:
                     f"Title: {result['title']}",
                     f"URL Source: {result['url']}",
                     f"Description: {result['description']}",
-                    "",
                 ]
             )
+            content = result.get("content")
+            if content:
+                if query:
+                    content = self.scraper.filter_relevant(content, query)
+                if len(content) > self.enrich_max_chars:
+                    content = content[:self.enrich_max_chars] + "..."
+                formatted_results.append(f"Content: {content}")
+                if self.scraper.cache is not None:
+                    formatted_results.append("（页面全文已缓存，scrape 该 URL 可立即获得完整内容）")
+            formatted_results.append("")
 
         return "\n".join(formatted_results).rstrip()
\ No newline at end of file
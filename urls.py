@@ -0,0 +1,65 @@
+import re
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# 只用于统计来源、不影响页面内容的查询参数
+TRACKING_PARAMS = frozenset(
+    ["gclid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "spm"]
+)
+TRACKING_PREFIXES = ("utm_",)
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"'`，。；、）】」》]+")
+# URL 末尾常跟着的英文标点不属于 URL
+URL_TRAILING = ".,;:!?)]}"
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化 URL，使同一页面的不同写法得到相同的键
+
+    - 补全缺失的 https 协议
+    - 协议和主机名小写，去掉默认端口
+    - 去掉片段（#...）和 utm_*、gclid 等跟踪参数
+    - 空路径统一为 "/"，其余路径去掉末尾的 "/"
+    """
+    url = url.strip()
+    if not url.startswith(("http://", "https://")):
+        url = f"https://{url}"
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    netloc = host
+    if port and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f"{host}:{port}"
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo += f":{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    path = parts.path.rstrip("/") or "/"
+
+    query = parts.query
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        kept = [(name, value) for name, value in params if not _is_tracking_param(name)]
+        if len(kept) != len(params):
+            query = urlencode(kept)
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def find_urls(text: str) -> List[str]:
+    """按出现顺序返回文本中去重后的 URL"""
+    urls = {}
+    for match in URL_PATTERN.finditer(text):
+        urls[match.group(0).rstrip(URL_TRAILING)] = None
+    return list(urls)
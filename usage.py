@@ -0,0 +1,129 @@
+import contextlib
+import os
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, TypedDict
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+# 接口没有返回费用时按单价估算（美元 / 百万 token，0 表示不估算）
+PRICE_PROMPT = float(os.getenv("LLM_PRICE_PROMPT", "0"))
+PRICE_COMPLETION = float(os.getenv("LLM_PRICE_COMPLETION", "0"))
+
+metrics.describe("deepsearch_llm_cost_total", "LLM 调用的费用（接口返回或按单价估算）")
+metrics.describe("deepsearch_llm_ttft_seconds", "LLM 调用的首 token 延迟（秒）")
+
+
+class LLMCall(TypedDict):
+    """单次模型调用的用量；estimated 为 True 表示接口没有返回 usage，token 数是估算的"""
+
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    reasoning_tokens: int
+    total_tokens: int
+    cost: float
+    seconds: float
+    ttft: float
+    estimated: bool
+
+
+def make_call(
+    model: str,
+    usage: Dict,
+    seconds: float,
+    ttft: float,
+    estimated_prompt: int = 0,
+    estimated_completion: int = 0,
+) -> LLMCall:
+    """由接口返回的 usage 构造调用记录；没有 usage 时使用传入的估算值"""
+    estimated = not usage.get("prompt_tokens") and not usage.get("completion_tokens")
+    prompt_tokens = int(usage.get("prompt_tokens") or (estimated_prompt if estimated else 0))
+    completion_tokens = int(usage.get("completion_tokens") or (estimated_completion if estimated else 0))
+    details = usage.get("completion_tokens_details") or {}
+    cost = usage.get("cost")
+    if cost is None:
+        cost = (prompt_tokens * PRICE_PROMPT + completion_tokens * PRICE_COMPLETION) / 1_000_000
+    return {
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "reasoning_tokens": int(details.get("reasoning_tokens") or 0),
+        "total_tokens": int(usage.get("total_tokens") or prompt_tokens + completion_tokens),
+        "cost": float(cost),
+        "seconds": seconds,
+        "ttft": ttft,
+        "estimated": estimated,
+    }
+
+
+def summarize_calls(calls: List[LLMCall]) -> Dict[str, float]:
+    """汇总一组调用：次数、各类 token 数、费用、模型耗时，以及首 token 延迟的平均值和最大值"""
+    summary: Dict[str, float] = {
+        "calls": len(calls),
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "reasoning_tokens": 0,
+        "total_tokens": 0,
+        "cost": 0.0,
+        "seconds": 0.0,
+    }
+    for call in calls:
+        for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens", "total_tokens", "cost", "seconds"):
+            summary[key] += call[key]
+    ttfts = [call["ttft"] for call in calls]
+    summary["ttft_avg"] = sum(ttfts) / len(ttfts) if ttfts else 0.0
+    summary["ttft_max"] = max(ttfts, default=0.0)
+    return summary
+
+
+class UsageTracker:
+    """
+    累计一个任务的所有模型调用
+
+    activate() 期间（包括其中创建的子任务）发生的调用都会记录到这里；
+    嵌套激活时同时记录到外层的 tracker。
+    """
+
+    def __init__(self, calls: Optional[List[LLMCall]] = None) -> None:
+        self.calls: List[LLMCall] = list(calls or [])
+        self.parent: Optional["UsageTracker"] = None
+
+    def record(self, call: LLMCall) -> None:
+        self.calls.append(call)
+        if self.parent is not None:
+            self.parent.record(call)
+
+    def totals(self, start: int = 0) -> Dict[str, float]:
+        """第 start 次调用之后的汇总（默认全部）"""
+        return summarize_calls(self.calls[start:])
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator["UsageTracker"]:
+        outer = llm_usage.get()
+        self.parent = outer if outer is not self else None
+        token = llm_usage.set(self)
+        try:
+            yield self
+        finally:
+            llm_usage.reset(token)
+            self.parent = None
+
+
+# 当前上下文中正在记账的 tracker
+llm_usage: ContextVar[Optional[UsageTracker]] = ContextVar("llm_usage", default=None)
+
+
+def record_call(call: LLMCall) -> None:
+    metrics.inc("deepsearch_llm_tokens_total", call["prompt_tokens"], type="prompt")
+    metrics.inc("deepsearch_llm_tokens_total", call["completion_tokens"], type="completion")
+    metrics.inc("deepsearch_llm_tokens_total", call["reasoning_tokens"], type="reasoning")
+    metrics.inc("deepsearch_llm_cost_total", call["cost"])
+    metrics.observe("deepsearch_llm_ttft_seconds", call["ttft"])
+    tracker = llm_usage.get()
+    if tracker is not None:
+        tracker.record(call)